@@ -23,14 +23,15 @@ class VNA:
         s.sendall(cmd.encode())
         s.settimeout(120)
         try:
+            #Only look for the terminator in the newest chunk, joining
+            #everything received so far after every recv is quadratic
             chunks = []
-            data = b''.join(chunks)
-            while not "\n" in data.decode():
-                chunk = s.recv(4096)
+            while not chunks or not chunks[-1].endswith(b"\n"):
+                chunk = s.recv(1 << 16)
                 if chunk == b'':
                     raise RuntimeError("socket connection broken")
                 chunks.append(chunk)
-                data = b''.join(chunks)
+            data = b''.join(chunks)
 
         except socket.timeout:
             s.close()
@@ -1,65 +1,91 @@
+import os
+import sys
 import socket
 import time
 import numpy as np
+import h5py
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'SCPI'))
+
+from SCPITransport import SCPITransport
 
 class VNA:
 
-    def __init__(self, server_ip='127.0.0.1', server_port=5025):
+    ## FORM:DATA argument and little endian dtype of each data format
+    dataFormats = {'ascii': ('ASCii', None), 'real32': ('REAL32', '<f4'), 'real': ('REAL', '<f8')}
+    ## Dtype of real, imag pairs in each binary data format
+    complexDtypes = {'real32': '<c8', 'real': '<c16'}
+
+    def __init__(self, server_ip='127.0.0.1', server_port=5025, dataFormat='real'):
         self.server_address = (server_ip, server_port)
+        # One connection for the whole session, reopened if it drops
+        self.scpi = SCPITransport(server_ip, server_port, timeout=120)
+        ## Reused to receive time domain sweeps
+        self._rawBuffer = bytearray()
+        self.setDataFormat(dataFormat)
+
+    def close(self):
+        self.scpi.close()
+
+    def printStats(self):
+        ## Commands sent, bytes and time spent per command
+        self.scpi.print_stats()
 
     def _sendCmd(self,cmd):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect(self.server_address)
-        s.sendall(cmd.encode())
-        s.close()
+        ## The session stays open, so an unread reply would be taken as the
+        ## reply to the next query
+        cmd = cmd.rstrip("\n")
+        if cmd.split(" ")[0].endswith("?"):
+            raise ValueError("Send queries with scpi.query or _getData, not _sendCmd: "+cmd)
+        self.scpi.write(cmd)
         return
 
     def _getData(self,cmd):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect(self.server_address)
         #Clear register
-        s.sendall("*CLS\n".encode())
-        s.sendall(cmd.encode())
-        s.settimeout(120)
+        self.scpi.write("*CLS")
         try:
-            chunks = []
-            data = b''.join(chunks)
-            while not "\n" in data.decode():
-                chunk = s.recv(4096)
-                if chunk == b'':
-                    raise RuntimeError("socket connection broken")
-                chunks.append(chunk)
-                data = b''.join(chunks)
-
+            datavals = self.scpi.query(cmd.rstrip("\n"))
         except socket.timeout:
-            s.close()
             raise RuntimeError("No data received from VNA")
-
-        datavals = data.decode()
-        datavals = datavals.rstrip("\n")
         return datavals
 
+    def setDataFormat(self, dataFormat='real'):
+        ## 'real' (64 bit) and 'real32' send binary blocks, much faster to
+        ## transfer and decode than 'ascii' for long sweeps
+        if dataFormat not in self.dataFormats:
+            raise ValueError("dataFormat must be one of "+str(list(self.dataFormats)))
+        self._sendCmd("FORM:DATA "+self.dataFormats[dataFormat][0]+";:FORM:BORD SWAP\n")
+        self.dataFormat = dataFormat
+
+    def _getArray(self,cmd):
+        ## Query an array of values, decoded straight into NumPy
+        if self.dataFormat == 'ascii':
+            return np.fromstring(self._getData(cmd), sep=',')
+
+        #Clear register
+        self.scpi.write("*CLS")
+        try:
+            block = self.scpi.query_block(cmd.rstrip("\n"))
+        except socket.timeout:
+            raise RuntimeError("No data received from VNA")
+        return np.frombuffer(block, dtype=self.dataFormats[self.dataFormat][1])
+
     def setPower(self, power):
         self._sendCmd("SOURce:POWer "+str(power)+"\n")
         print("SOURce:POWer "+str(power))
         #power should be in dBm
 
     def getPower(self):
-        power=0
-        power=self._sendCmd("SOURce:POWer?"+"\n")
+        power=float(self.scpi.query("SOURce:POWer?"))
         print("Power is "+str(power)+" dBm")
         return power
 
     def singleTrigAndWait(self):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect(self.server_address)
         print("Starting frequency sweep and waiting for complete. . .")
-        s.sendall("TRIG:SING\n".encode())
-        s.sendall("DISP:WIND:TRAC:Y:AUTO\n".encode())
-        s.sendall("*OPC?\n".encode())
-        opComplete = s.recv(8)
+        self._sendCmd("TRIG:SING\n")
+        self._sendCmd("DISP:WIND:TRAC:Y:AUTO\n")
+        opComplete = self.scpi.query("*OPC?")
         print("Done. . . ", "("+str(opComplete)+")")
-        s.close()
         return
 
     def takeSweep(self, f_min, f_max, n_step, n_avs, ifb=10e3, s_parameter="S21"):
@@ -81,33 +107,12 @@ class VNA:
         self._sendCmd("DISP:WIND:TRAC:Y:AUTO\n")
         self.singleTrigAndWait()
 
-        data = self._getData("CALC:TRAC:DATA:FDAT?\n")
-        fs = self._getData("SENS:FREQ:DATA?\n")
-
-        freqs=str(fs)
-        S21=str(data)
-        #S21_phase=str(phase_data
-
-        f = freqs.split(",")
-        S21 = S21.split(',')
-        I = S21[::2]
-        Q = S21[1::2]
-
-        #print(freqs)
-        freqs = [float(i) for i in f]
-        Ivals = [float(i) for i in I]
-        Qvals = [float(i) for i in Q]
-        #print(S21)
-        return np.array(freqs), np.array(Ivals), np.array(Qvals)
+        S21 = self._getArray("CALC:TRAC:DATA:FDAT?\n")
+        freqs = self._getArray("SENS:FREQ:DATA?\n")
 
-    def timeDomain(self, lapse, f0, npts, ifb=10e3):
-        ## Show the time details
-        print("Taking time domain trace with:")
-        print("-     CW F [Hz]:", f0)
-        print("- Number points:", npts)
-        print("- Sampling rate:", ifb)
-        print("-  Duration [s]:", lapse)
+        return freqs, S21[0::2], S21[1::2]
 
+    def _setupTimeDomain(self, f0, npts, ifb):
         ## Set the frequency parameters
         self._sendCmd("SENS:FREQ:STAR "+str(f0)+"\n")
         self._sendCmd("SENS:FREQ:STOP "+str(f0)+"\n")
@@ -136,26 +141,119 @@ class VNA:
 
         self._sendCmd("DISPlay:UPDate:IMMediate\n")
 
-        data = ""
-        tpts = ""
-        elapsed = 0
+    def _readBlock(self, npts):
+        ## Read the last sweep's npts points of S21 as sent, into a receive
+        ## buffer kept from one sweep to the next. The returned view is only
+        ## good until the next read. ASCII data can't be read undecoded.
+        if self.dataFormat == 'ascii':
+            return self._getArray("CALC1:DATA:SDAT?\n").view(complex)
+
+        size = npts*np.dtype(self.complexDtypes[self.dataFormat]).itemsize
+        if len(self._rawBuffer) < size:
+            self._rawBuffer = bytearray(size)
+        self.scpi.write("*CLS")
+        return self.scpi.query_block("CALC1:DATA:SDAT?", into=self._rawBuffer)
+
+    def _decodeBlock(self, raw, out):
+        ## Decode a block from _readBlock into the complex array out
+        if self.dataFormat == 'ascii':
+            out[:] = raw
+        else:
+            out[:] = np.frombuffer(raw, dtype=self.complexDtypes[self.dataFormat])
+
+    def streamTimeDomain(self, lapse, f0, npts, ifb=10e3, nBlocks=None, fileName=None, callback=None):
+        ## Take CW sweeps of npts points back to back until lapse seconds
+        ## of live time have been measured.
+        ##
+        ## Each sweep's complex S21 is written into a pre-sized ring buffer
+        ## of nBlocks sweeps, the oldest overwritten once it's full (None
+        ## to keep every sweep, growing the buffer as needed), and appended
+        ## to the HDF5 file fileName if given, flushed after every sweep.
+        ## The sweep's bytes are read as soon as it's done and the next
+        ## sweep is triggered straight away, so decoding and writing a block
+        ## happen while the instrument takes the next one (ASCII data is
+        ## decoded as it's read, only writing overlaps then).
+        ##
+        ## callback(i, t, S21) is called after each sweep, with its number,
+        ## the time it was triggered and its data.
+        ##
+        ## Returns the trigger time of each sweep kept, the frequencies and
+        ## the (sweeps, npts) complex S21, oldest first.
+        self._setupTimeDomain(f0, npts, ifb)
+
+        ## The frequencies don't change from sweep to sweep
+        freqs = self._getArray("SENS:FREQ:DATA?\n")
 
-        ## Take a single time domain trace
-        while (elapsed < lapse):
+        ring = np.empty((nBlocks or max(int(np.ceil(lapse*ifb/npts)), 1), npts), dtype=complex)
+        times = np.empty(len(ring))
+
+        f = None
+        if fileName is not None:
+            f = h5py.File(fileName, "w", libver="latest")
+            f.create_dataset("freqs", data=freqs)
+            f.create_dataset("time", shape=(0,), maxshape=(None,), dtype='f8', chunks=(1024,))
+            f.create_dataset("S21", shape=(0, npts), maxshape=(None, npts), dtype=complex, chunks=(1, npts))
+            f.attrs["f0"] = f0
+            f.attrs["ifb"] = ifb
+            f.swmr_mode = True
+
+        try:
+            count = 0
+            elapsed = 0
+            self._sendCmd("TRIG:SING\n")
             bgn = time.time()
-            self.singleTrigAndWait()
-            elapsed += (time.time() - bgn)
-            print("Live-time elapsed:",elapsed,"seconds")
 
-            ## Pull the data 
-            data += self._getData("CALC:TRAC:DATA:FDAT?\n")
-            tpts += self._getData("SENS:FREQ:DATA?\n")
+            while True:
+                self.scpi.query("*OPC?")
+                elapsed += (time.time() - bgn)
+                t = bgn
+
+                if count == len(ring) and nBlocks is None:
+                    ring = np.concatenate([ring, np.empty_like(ring)])
+                    times = np.concatenate([times, np.empty_like(times)])
+                row = count % len(ring)
+                raw = self._readBlock(npts)
+
+                done = elapsed >= lapse
+                if not done:
+                    self._sendCmd("TRIG:SING\n")
+                    bgn = time.time()
+
+                self._decodeBlock(raw, ring[row])
+                times[row] = t
+                if f is not None:
+                    f["S21"].resize(count + 1, axis=0)
+                    f["time"].resize(count + 1, axis=0)
+                    f["S21"][count] = ring[row]
+                    f["time"][count] = t
+                    f.flush()
+                if callback is not None:
+                    callback(count, t, ring[row])
+                count += 1
+
+                if done:
+                    break
+        finally:
+            if f is not None:
+                f.close()
         print("Total live-time elapsed:",elapsed,"seconds")
 
-        S21  = str(data).split(',')
-        tpts = str(tpts).split(",")
-        
-        S21_real = S21[::2]
-        S21_imag = S21[1::2]
+        ## Oldest sweep first
+        kept = min(count, len(ring))
+        order = (np.arange(kept) + count - kept) % len(ring)
+        return times[order], freqs, ring[order]
+
+    def timeDomain(self, lapse, f0, npts, ifb=10e3):
+        ## Show the time details
+        print("Taking time domain trace with:")
+        print("-     CW F [Hz]:", f0)
+        print("- Number points:", npts)
+        print("- Sampling rate:", ifb)
+        print("-  Duration [s]:", lapse)
+
+        times, freqs, S21 = self.streamTimeDomain(lapse, f0, npts, ifb)
+
+        tpts = np.tile(freqs, len(S21))
+        S21  = S21.ravel()
 
-        return tpts, S21_real, S21_imag
\ No newline at end of file
+        return tpts, S21.real, S21.imag
\ No newline at end of file
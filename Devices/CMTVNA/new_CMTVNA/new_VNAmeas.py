@@ -3,6 +3,7 @@
 import numpy as np
 import h5py
 import os
+from collections import OrderedDict
 
 class VNAMeas:
 
@@ -58,10 +59,9 @@ class VNAMeas:
 		## Configure filepath
 		if not os.path.isdir(filepath):
 			os.makedirs(filepath)
-		os.chdir(filepath)
 		print("Saving data to", filepath, "as", filename+".h5")
 			
-		with h5py.File(filename+".h5", "w") as f:
+		with h5py.File(os.path.join(filepath, filename+".h5"), "w") as f:
 			d_series      = f.create_dataset("series" , data=np.array([self.series], dtype='S'))
 			d_device      = f.create_dataset("device" , data=np.array([self.device], dtype='S'))
 			d_s_parameter = f.create_dataset("s_parameter", data=np.array([self.s_parameter], dtype='S'))
@@ -92,6 +92,283 @@ class VNAMeas:
 		return logmag, phases
 
 
+## Row of the metadata table of a run file, one per sweep
+meta_dtype = np.dtype([("series", "S32"), ("device", "S64"), ("s_parameter", "S8"),
+					   ("vna_power", "f8"), ("device_power", "f8"), ("n_avgs", "i8"),
+					   ("n_samps", "i8"), ("f_min", "f8"), ("f_max", "f8")])
+
+def _encode(value):
+	return value if isinstance(value, bytes) else str(value).encode('UTF-8')
+
+def _fitted_meta_dtype(rows):
+	## meta_dtype with its string fields widened to fit rows, numpy would
+	## silently cut longer strings short
+	fields = []
+	for j, name in enumerate(meta_dtype.names):
+		dtype = meta_dtype[name]
+		if dtype.kind == "S":
+			dtype = np.dtype("S%d" % max([dtype.itemsize] + [len(_encode(row[j])) for row in rows]))
+		fields.append((name, dtype))
+	return np.dtype(fields)
+
+class VNARunFile:
+	## One HDF5 file for a whole run (e.g. a power scan), instead of one
+	## file per sweep. Sweeps are appended to resizable (n_sweeps, n_points)
+	## datasets "freqs", "amps" and "phases", one compressed chunk per
+	## sweep, and their metadata to the table "meta". Appending to an
+	## existing run file carries on where it stopped.
+	##
+	## The file is written in SWMR mode and flushed after every sweep, so
+	## read_run_hdf5 (or h5py with swmr=True) can look at the run while
+	## it's being taken.
+	##
+	##	with VNARunFile(expt_path, series) as run:
+	##		for power in powers:
+	##			...
+	##			sweep.store_data(f, I, Q)
+	##			run.append(sweep)
+
+	def __init__(self, filepath, filename, compression="gzip"):
+		if not os.path.isdir(filepath):
+			os.makedirs(filepath)
+		if filename[-3:] != ".h5":
+			filename += ".h5"
+		self.filename = os.path.join(filepath, filename)
+		self.compression = compression
+
+		self.f = h5py.File(self.filename, "a", libver="latest")
+		if "meta" in self.f:
+			self.f.swmr_mode = True
+
+	def __len__(self):
+		return len(self.f["meta"]) if "meta" in self.f else 0
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		self.f.close()
+
+	def _create(self, n_points):
+		## Datasets can't be added once in SWMR mode, so they're all made
+		## with the first sweep
+		self.f.create_dataset("meta", shape=(0,), maxshape=(None,), dtype=meta_dtype, chunks=(256,))
+		for name in ("freqs", "amps", "phases"):
+			self.f.create_dataset(name, shape=(0, n_points), maxshape=(None, n_points), dtype=float,
+								  chunks=(1, n_points), compression=self.compression, shuffle=True)
+		self.f.swmr_mode = True
+
+	def append(self, sweep):
+		## Add a VNAMeas, returns its index in the run
+		if "meta" not in self.f:
+			self._create(len(sweep.freqs))
+
+		row = (sweep.series, sweep.device, sweep.s_parameter,
+			   sweep.vna_power, sweep.device_power, sweep.n_avgs,
+			   sweep.n_samps, sweep.f_min, sweep.f_max)
+		## The table's strings are fixed length (variable length data isn't
+		## safe to read while it's written in SWMR mode), don't cut them short
+		if _fitted_meta_dtype([row]) != meta_dtype:
+			raise ValueError("Strings too long for the run file's metadata: %r, at most %s"
+							 % (row[:3], [meta_dtype[name].itemsize for name in meta_dtype.names[:3]]))
+
+		i = len(self)
+		for name in ("meta", "freqs", "amps", "phases"):
+			self.f[name].resize(i + 1, axis=0)
+
+		self.f["meta"][i] = row
+		self.f["freqs"][i]  = sweep.freqs
+		self.f["amps"][i]   = sweep.amps
+		self.f["phases"][i] = sweep.phases
+		self.f.flush()
+		return i
+
+
+def _from_meta(meta):
+	## VNAMeas from a row of the metadata table, without data
+	sweep = VNAMeas(meta["series"].decode('UTF-8'))
+	sweep.device  = meta["device"].decode('UTF-8')
+	sweep.s_parameter = meta["s_parameter"].decode('UTF-8')
+
+	sweep.n_avgs  = meta["n_avgs"]
+	sweep.n_samps = meta["n_samps"]
+	sweep.f_min   = meta["f_min"]
+	sweep.f_max   = meta["f_max"]
+
+	sweep.vna_power    = meta["vna_power"]
+	sweep.device_power = meta["device_power"]
+	return sweep
+
+
+def read_run_hdf5(filepath, filename, index):
+	## Read one sweep of a run file written by VNARunFile, also while it's
+	## still being written
+	filename = os.path.join(filepath, filename)
+	if filename[-3:] != ".h5":
+		filename += ".h5"
+
+	with h5py.File(filename, "r", libver="latest", swmr=True) as f:
+		meta = f["meta"][index]
+		sweep = _from_meta(meta)
+
+		sweep.freqs  = f["freqs"][index]
+		sweep.amps   = f["amps"][index]
+		sweep.phases = f["phases"][index]
+
+		return sweep
+
+
+class LazySweeps:
+	## 2-D (sweep x frequency point) view of one quantity ("freqs", "amps"
+	## or "phases") of a VNARun, read from disk only when indexed:
+	##
+	##	run.amps[10:20]			## sweeps 10 to 19
+	##	run.phases[:, 500]		## point 500 of every sweep
+	##	run.amps[order]			## sweeps in any order, e.g. by power
+
+	def __init__(self, run, name):
+		self.run  = run
+		self.name = name
+
+	@property
+	def shape(self):
+		return self.run.shape
+
+	@property
+	def dtype(self):
+		return np.dtype(float)
+
+	def __len__(self):
+		return self.shape[0]
+
+	def __array__(self, dtype=None, copy=None):
+		return np.asarray(self[:], dtype=dtype)
+
+	def __getitem__(self, key):
+		if not isinstance(key, tuple):
+			key = (key,)
+		rows = np.arange(self.shape[0])[key[0]]
+		cols = key[1] if len(key) > 1 else slice(None)
+
+		index = np.atleast_1d(rows)
+		points = np.arange(self.shape[1])[cols]
+		out = np.empty(index.shape + points.shape)
+
+		## Gather the rows block by block
+		blocks = index // self.run.block_size
+		for b in np.unique(blocks):
+			here = blocks == b
+			block = self.run._block(self.name, b)
+			out[here] = block[index[here] - b*self.run.block_size][:, cols]
+
+		return out[0] if np.ndim(rows) == 0 else out
+
+
+class VNARun:
+	## Read-only view of all the sweeps of a run, either a run file written
+	## by VNARunFile or a directory of files written by save_hdf5, without
+	## loading them.
+	##
+	## The metadata of every sweep is read up front into the table
+	## self.meta (fields as in meta_dtype, strings widened as needed for a
+	## directory). freqs, amps and phases are
+	## LazySweeps, (n_sweeps, n_points) arrays read on demand in blocks of
+	## block_size sweeps, through HDF5 hyperslabs for a run file. The last
+	## max_blocks blocks read are kept, least recently used dropped first.
+	##
+	##	run = VNARun(os.path.join(expt_path, series+".h5"))
+	##	order = np.argsort(run.meta["device_power"])
+	##	plt.pcolormesh(run.freqs[0], run.meta["device_power"][order], run.amps[order])
+
+	def __init__(self, path, block_size=64, max_blocks=16):
+		self.path = path
+		self.block_size = block_size
+		self.max_blocks = max_blocks
+		self._blocks = OrderedDict()
+
+		if os.path.isdir(path):
+			self.f = None
+			self.files = sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".h5"))
+			rows = []
+			n_points = set()
+			for filename in self.files:
+				with h5py.File(filename, "r") as f:
+					rows.append(tuple(f[field][0] for field in meta_dtype.names))
+					n_points.add(len(f["freqs"]))
+			self.meta = np.array(rows, dtype=_fitted_meta_dtype(rows))
+			if len(n_points) > 1:
+				raise ValueError("Sweeps in "+path+" don't all have the same number of points")
+			self.shape = (len(self.files), n_points.pop() if n_points else 0)
+		else:
+			self.files = None
+			self.f = h5py.File(path, "r", libver="latest", swmr=True)
+			self.refresh()
+
+		self.freqs  = LazySweeps(self, "freqs")
+		self.amps   = LazySweeps(self, "amps")
+		self.phases = LazySweeps(self, "phases")
+
+	def refresh(self):
+		## Pick up sweeps added to a run file since it was opened
+		if self.f is None:
+			return
+		for name in ("meta", "freqs", "amps", "phases"):
+			self.f[name].refresh()
+		self.meta  = self.f["meta"][()]
+		self.shape = (len(self.meta), self.f["freqs"].shape[1])
+		## Blocks read before they were full may have grown since
+		for key in [key for key, block in self._blocks.items() if len(block) < self.block_size]:
+			del self._blocks[key]
+
+	def close(self):
+		if self.f is not None:
+			self.f.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def __len__(self):
+		return self.shape[0]
+
+	def __getitem__(self, index):
+		## One sweep as a VNAMeas
+		meta = self.meta[index]
+		sweep = _from_meta(meta)
+
+		sweep.freqs  = self.freqs[index]
+		sweep.amps   = self.amps[index]
+		sweep.phases = self.phases[index]
+		return sweep
+
+	def _block(self, name, b):
+		## Sweeps b*block_size to (b+1)*block_size of one quantity
+		key = (name, b)
+		if key in self._blocks:
+			self._blocks.move_to_end(key)
+			return self._blocks[key]
+
+		start = b*self.block_size
+		stop  = min(start + self.block_size, len(self))
+		if self.f is not None:
+			block = self.f[name][start:stop]
+		else:
+			block = np.empty((stop - start, self.shape[1]))
+			for i in range(start, stop):
+				with h5py.File(self.files[i], "r") as f:
+					f[name].read_direct(block, dest_sel=np.s_[i - start])
+
+		self._blocks[key] = block
+		while len(self._blocks) > self.max_blocks:
+			self._blocks.popitem(last=False)
+		return block
+
+
 def read_hdf5(filepath, filename):
 	filename = os.path.join(filepath, filename)
 	if filename[-3:] != ".h5":
@@ -1,22 +1,24 @@
-import socket
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SCPI'))
+
+from SCPITransport import SCPITransport
 
 class E36300:
 
     def __init__(self,server_ip="192.168.0.40",server_port=5025):
         self.server_address = (server_ip, server_port)
+        # One connection kept open for every command, reopened if it drops
+        self.scpi = SCPITransport(server_ip, server_port, timeout=1)
 
     def _sendCmd(self,cmd,getResponse=True):
-        cmdStr = cmd+"\n"
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect(self.server_address)
-            s.settimeout(1)
-            s.sendall(cmdStr.encode())
-            if(getResponse):
-                data = s.recv(1024)
-                retStr = data.decode()
+        if(getResponse):
+            return self.scpi.query(cmd)
+        self.scpi.write(cmd)
 
-        if (getResponse):
-            return retStr[:-1]
+    def close(self):
+        self.scpi.close()
 
     def getID(self):
         return self._sendCmd("*IDN?");
@@ -0,0 +1,378 @@
+# AsyncLakeshore372.py
+
+import time
+import asyncio
+import numpy as np
+
+from Lakeshore372 import Channel, Heater, Pacer, heater_range_key, reading_queries
+
+
+class AsyncLS372:
+    """
+        asyncio version of the Lakeshore 372 class.
+
+    All commands go through a single queue, served by one task that owns the
+    TCP connection, so any number of coroutines can talk to the 372 at once
+    without blocking the event loop or each other. Queries that are waiting
+    in the queue together are pipelined: they're packed into one compound
+    command line and their replies split back out.
+
+    Usage::
+
+        async with AsyncLS372('192.168.1.144') as ls:
+            r = await ls.channels[1].get_resistance_reading()
+
+    Attributes:
+        channels - list of channels, index corresponds to channel number with
+                   index 0 corresponding to the control channel, 'A'
+    """
+    # Longest line we'll build when packing several queries into one command
+    max_command_length = 64
+
+    def __init__(self, ip, timeout=10, num_channels=16, port=7777,
+                 quiet_time=0.061, reading_rate=10):
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.num_channels = num_channels
+        self.pacer = Pacer(quiet_time, reading_rate)
+
+        self.id = None
+        self.reader = None
+        self.writer = None
+        self._queue = None
+        self._worker = None
+
+        self.channels = [AsyncChannel(self, 'A')]
+        self.channels += [AsyncChannel(self, i) for i in range(1, num_channels + 1)]
+
+        self.sample_heater = AsyncHeater(self, 0)
+        self.still_heater = AsyncHeater(self, 2)
+
+    async def open(self):
+        """Open the connection and start the command queue."""
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.ip, self.port), self.timeout)
+        except OSError as e:
+            raise ConnectionError("Cannot connect to LS372") from e
+
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._serve())
+        self.id = await self.get_id()
+        return self
+
+    async def close(self):
+        """Stop the command queue and close the connection."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+            self.writer = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def msg(self, message):
+        """Send message to the Lakeshore 372 over ethernet.
+
+        Same as LS372.msg, but awaitable: the message is queued and the
+        coroutine resumes when its reply (if any) has arrived.
+
+        :param message: Message string as described in the Lakeshore 372 manual.
+        :type message: str
+
+        :returns: Response string from the Lakeshore, if any. Else, an empty
+                  string.
+        :rtype: str
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((message, future))
+        return await future
+
+    async def _serve(self):
+        """Send queued commands one line at a time, paced like LS372.msg."""
+        carry = None
+        while True:
+            if carry is None:
+                batch = [await self._queue.get()]
+            else:
+                batch, carry = [carry], None
+
+            # Pipeline: pack queries that are already waiting into this line
+            if '?' in batch[0][0]:
+                while not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    line = ';'.join([m for m, _ in batch] + [item[0]])
+                    if '?' not in item[0] or len(line) > self.max_command_length:
+                        carry = item
+                        break
+                    batch.append(item)
+
+            messages = [m for m, _ in batch]
+            futures = [f for _, f in batch]
+            try:
+                replies = await self._exchange(messages)
+            except Exception as e:
+                for f in futures:
+                    if not f.done():
+                        f.set_exception(e)
+            else:
+                for f, r in zip(futures, replies):
+                    if not f.done():
+                        f.set_result(r)
+
+    async def _exchange(self, messages):
+        line = ';'.join(messages)
+        readings = self.pacer.count_readings(line)
+
+        await asyncio.sleep(self.pacer.delay(readings))
+        self.pacer.sent(readings)
+
+        try:
+            self.writer.write(f'{line}\r\n'.encode())
+            await self.writer.drain()
+
+            if '?' not in line:
+                return ['']
+
+            # Try once, if we timeout, try again. Usually gets around single event glitches.
+            for attempt in range(2):
+                try:
+                    resp = await asyncio.wait_for(self.reader.readuntil(b'\n'), self.timeout)
+                    break
+                except asyncio.TimeoutError:
+                    print("Warning: Caught timeout waiting for response to '%s', trying again " \
+                          "before giving up" % line)
+                    if attempt == 1:
+                        raise RuntimeError('Query response to Lakeshore timed out after two ' \
+                                           'attempts. Check connection.')
+        finally:
+            self.pacer.mark()
+
+        replies = [r.strip() for r in str(resp, 'utf-8').strip().split(';')]
+        if len(replies) != len(messages):
+            raise RuntimeError(f"Expected {len(messages)} replies to '{line}', got {len(replies)}")
+        return replies
+
+    async def get_id(self):
+        """Get the ID number of the Lakeshore unit."""
+        return await self.msg('*IDN?')
+
+    async def get_autoscan(self):
+        """Determine state of autoscan.
+
+        :returns: state of autoscanner
+        :rtype: bool
+        """
+        resp = await self.msg('SCAN?')
+        return bool(int(resp.split(',')[1]))
+
+    async def get_active_channel(self):
+        """Query the Lakeshore for which channel it's currently scanning.
+
+        :returns: channel object describing the scanned channel
+        :rtype: AsyncChannel
+        """
+        resp = await self.msg('SCAN?')
+        return self.channels[int(resp.split(',')[0])]
+
+    async def read_many(self, channels=None, quantities=('resistance', 'power')):
+        """Read several quantities from several channels.
+
+        The queries are all issued at once, so the command queue pipelines
+        them into a few compound lines. See LS372.read_many.
+
+        :returns: one record per channel with fields 'channel', 'time' and
+                  one per quantity
+        :rtype: numpy structured array
+        """
+        if channels is None:
+            channels = range(1, self.num_channels + 1)
+        channels = [0 if c == 'A' else int(c) for c in channels]
+
+        for q in quantities:
+            assert q in reading_queries, f"{q} not one of {list(reading_queries)}"
+
+        async def read(chan):
+            c = 'A' if chan == 0 else chan
+            resp = await asyncio.gather(*[self.msg(f"{reading_queries[q][0]} {c}") for q in quantities])
+            return (chan, time.time(), *[float(r) for r in resp])
+
+        dtype = [('channel', 'i4'), ('time', 'f8')] + [(q, reading_queries[q][1]) for q in quantities]
+        rows = await asyncio.gather(*[read(chan) for chan in channels])
+        return np.array(rows, dtype=dtype)
+
+
+class AsyncChannel:
+    """Lakeshore 372 Channel Object with awaitable getters.
+
+    Mirrors the getters of Channel, storing results in the same attributes.
+
+    :param ls: Lakeshore unit for communication
+    :type ls: AsyncLS372 Object
+    :param channel_num: The channel number (1-8 or 1-16 depending on scanner
+                        type)
+    :type channel_num: int
+    """
+    _parse_input_channel_parameter = Channel._parse_input_channel_parameter
+    _parse_input_setup = Channel._parse_input_setup
+    _parse_sensor_input_name = Channel._parse_sensor_input_name
+    _parse_temperature_limit = Channel._parse_temperature_limit
+    __str__ = Channel.__str__
+
+    def __init__(self, ls, channel_num):
+        self.ls = ls
+        self.channel_num = channel_num
+
+    async def get_input_channel_parameter(self):
+        """Run Input Channel Parameter Query, see Channel.get_input_channel_parameter."""
+        return self._parse_input_channel_parameter(await self.ls.msg(f"INSET? {self.channel_num}"))
+
+    async def get_input_setup(self):
+        """Run Input Setup Query, see Channel.get_input_setup."""
+        return self._parse_input_setup(await self.ls.msg(f"INTYPE? {self.channel_num}"))
+
+    async def get_sensor_input_name(self):
+        """Run Sensor Input Name Query."""
+        return self._parse_sensor_input_name(await self.ls.msg(f"INNAME? {self.channel_num}"))
+
+    async def get_temperature_limit(self):
+        """Get temperature limit in Kelvin, 0 if disabled."""
+        return self._parse_temperature_limit(await self.ls.msg(f"TLIMIT? {self.channel_num}"))
+
+    async def refresh(self):
+        """Fetch all channel settings, pipelined into a single round trip."""
+        await asyncio.gather(self.get_input_channel_parameter(), self.get_input_setup(),
+                             self.get_sensor_input_name(), self.get_temperature_limit())
+
+    async def get_excitation_mode(self):
+        await self.get_input_setup()
+        return self.mode
+
+    async def get_excitation(self):
+        await self.get_input_setup()
+        return self.excitation
+
+    async def get_resistance_range(self):
+        await self.get_input_setup()
+        return self.range
+
+    async def get_units(self):
+        await self.get_input_setup()
+        return self.units
+
+    async def get_dwell(self):
+        await self.get_input_channel_parameter()
+        return self.dwell
+
+    async def get_pause(self):
+        await self.get_input_channel_parameter()
+        return self.pause
+
+    async def get_calibration_curve(self):
+        await self.get_input_channel_parameter()
+        return self.curve_num
+
+    async def get_temperature_coefficient(self):
+        await self.get_input_channel_parameter()
+        return self.tempco
+
+    async def get_excitation_power(self):
+        """Get the most recent power calculation for the channel in Watts."""
+        return float(await self.ls.msg(f"RDGPWR? {self.channel_num}"))
+
+    async def get_kelvin_reading(self):
+        """Get temperature reading from channel in Kelvin."""
+        return float(await self.ls.msg(f"RDGK? {self.channel_num}"))
+
+    async def get_resistance_reading(self):
+        """Get resistance reading from channel in Ohms."""
+        return float(await self.ls.msg(f"RDGR? {self.channel_num}"))
+
+    async def get_sensor_reading(self):
+        """Get sensor reading from channel in Ohms."""
+        return float(await self.ls.msg(f"SRDG? {self.channel_num}"))
+
+    async def get_reading_status(self):
+        """Get status of input reading, see Channel.get_reading_status."""
+        resp = await self.ls.msg(f"RDGST? {self.channel_num}")
+        return Channel._decode_reading_status(resp)
+
+
+class AsyncHeater:
+    """Heater class for AsyncLS372 with awaitable getters.
+
+    Mirrors the getters of Heater, storing results in the same attributes.
+
+    :param ls: the lakeshore object we're controlling
+    :type ls: AsyncLS372
+    :param output: the heater output we want to control, 0 = sample,
+                   1 = warm-up, 2 = still
+    :type output: int
+    """
+    _parse_output_mode = Heater._parse_output_mode
+    _parse_heater_setup = Heater._parse_heater_setup
+
+    def __init__(self, ls, output):
+        self.ls = ls
+        self.output = output
+
+    async def get_output_mode(self):
+        """Query the heater mode using the OUTMODE? command."""
+        return self._parse_output_mode(await self.ls.msg(f"OUTMODE? {self.output}"))
+
+    async def get_heater_setup(self):
+        """Gets Heater setup params with the HTRSET? command."""
+        return self._parse_heater_setup(await self.ls.msg(f"HTRSET? {self.output}"))
+
+    async def get_mode(self):
+        await self.get_output_mode()
+        return self.mode
+
+    async def get_input_channel(self):
+        await self.get_output_mode()
+        return self.input
+
+    async def get_heater_range(self):
+        """Get heater range with RANGE? command."""
+        resp = await self.ls.msg(f"RANGE? {self.output}")
+
+        if self.output == 0:
+            self.range = heater_range_key[resp]
+        else:
+            on_off_key = {"0": "Off", "1": "On"}
+            self.range = on_off_key[resp]
+
+        return self.range
+
+    async def get_manual_out(self):
+        return float(await self.ls.msg(f"MOUT? {self.output}"))
+
+    async def get_sample_heater_output(self):
+        """Get sample heater output, see Heater.get_sample_heater_output."""
+        return float(await self.ls.msg("HTR?"))
+
+    async def get_setpoint(self):
+        return await self.ls.msg(f"SETP? {self.output}")
+
+    async def get_still_output(self):
+        return await self.ls.msg("STILL?")
+
+    async def get_pid(self):
+        """Get PID parameters with PID? command.
+
+        :returns: P, I, D
+        :rtype: float, float, float
+        """
+        resp = (await self.ls.msg(f"PID? {self.output}")).split(',')
+        return float(resp[0]), float(resp[1]), float(resp[2])
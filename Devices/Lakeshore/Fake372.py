@@ -0,0 +1,358 @@
+# Fake372.py
+
+import re
+import sys
+import math
+import time
+import random
+import socket
+import threading
+
+
+class Fake372:
+    """Simulated Lakeshore 372 on a local TCP socket.
+
+    Speaks the subset of the protocol used by Lakeshore372.py, so the driver,
+    the examples and benchmarks can run without an instrument:
+    *IDN?, SCAN(?), INSET(?), INTYPE(?), INNAME(?), TLIMIT(?), RDGR?, RDGK?,
+    SRDG?, KRDG?, RDGPWR?, RDGST?, CRVHDR(?), CRVPT(?), CRVDEL, HTRSET(?),
+    OUTMODE(?), RANGE(?), MOUT(?), HTR?, SETP(?), PID(?), RAMP(?), RAMPST?,
+    STILL(?). Several commands can be joined with ';' on one line, replies to
+    the queries among them are joined with ';'.
+
+    Readings change 10 times a second. With autoscan on, the scanner steps
+    through enabled channels after each channel's pause + dwell time.
+
+    Usage::
+
+        with Fake372(latency=0.005) as fake:
+            ls = LS372('127.0.0.1', port=fake.port)
+
+    :param host: interface to listen on
+    :type host: str
+    :param port: port to listen on, 0 picks a free one (see self.port)
+    :type port: int
+    :param latency: time in seconds before each reply is sent
+    :type latency: float
+    :param quiet_time: commands arriving sooner than this after the previous
+                       exchange count as quiet-time violations
+    :type quiet_time: float
+    :param strict: ignore commands that violate the quiet time, like a real
+                   372 can
+    :type strict: bool
+    :param timeout_rate: probability that a query gets no reply at all
+    :type timeout_rate: float
+    :param num_channels: number of scanner channels
+    :type num_channels: int
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, quiet_time=0.05, strict=False,
+                 timeout_rate=0.0, num_channels=16):
+        self.latency = latency
+        self.quiet_time = quiet_time
+        self.strict = strict
+        self.timeout_rate = timeout_rate
+        self.num_channels = num_channels
+
+        self.commands = 0
+        self.lines = 0
+        self.quiet_violations = 0
+        self._drop = 0
+        self._stall = []
+        self._last = -float('inf')
+        self._lock = threading.Lock()
+
+        channels = ['A'] + [str(i) for i in range(1, num_channels + 1)]
+        self.inset = {c: ['1', '10', '3', '0', '1'] for c in channels}
+        self.intype = {c: ['0', '2', '1', '10', '0', '2'] for c in channels}
+        self.intype['A'] = ['1', '2', '0', '1', '0', '2']
+        self.inname = {c: f'Channel {c}' for c in channels}
+        self.tlimit = {c: 0.0 for c in channels}
+
+        self.scan_channel = 1
+        self.autoscan = 0
+        self._scan_since = time.monotonic()
+
+        self.curves = {}
+
+        self.outmode = {'0': ['0', '1', '0', '0', '1', '1'],
+                        '1': ['0', '1', '0', '0', '1', '1'],
+                        '2': ['0', '1', '0', '0', '1', '1']}
+        self.htrset = {'0': ['120', '0', '0', '2'],
+                       '1': ['120', '0', '0', '2'],
+                       '2': ['120', '0', '0', '2']}
+        self.range = {'0': '0', '1': '0', '2': '0'}
+        self.mout = {'0': 0.0, '1': 0.0, '2': 0.0}
+        self.setp = {'0': 0.0, '1': 0.0, '2': 0.0}
+        self.ramp = {'0': ['0', '0'], '1': ['0', '0'], '2': ['0', '0']}
+        self._ramp_until = {'0': 0.0, '1': 0.0, '2': 0.0}
+        self.pid = {'0': [10.0, 20.0, 0.0], '1': [10.0, 20.0, 0.0], '2': [10.0, 20.0, 0.0]}
+        self.still = 0.0
+
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self.host, self.port = self._server.getsockname()
+        self._thread = None
+
+    # Server
+
+    def start(self):
+        """Start accepting connections in a background thread."""
+        self._server.listen()
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop accepting connections."""
+        self._server.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def drop_replies(self, n=1):
+        """Don't reply to the next n queries, to test timeout handling."""
+        with self._lock:
+            self._drop += n
+
+    def delay_replies(self, seconds, n=1):
+        """Hold back the next n replies an extra number of seconds, like a 372
+        that's slow to answer."""
+        with self._lock:
+            self._stall += [seconds] * n
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        buf = b''
+        with conn:
+            while True:
+                try:
+                    data = conn.recv(4096)
+                except OSError:
+                    return
+                if not data:
+                    return
+                buf += data
+                while b'\n' in buf:
+                    line, buf = buf.split(b'\n', 1)
+                    reply = self.handle_line(line.decode().strip())
+                    if reply is not None:
+                        with self._lock:
+                            stall = self._stall.pop(0) if self._stall else 0
+                        time.sleep(self.latency + stall)
+                        conn.sendall((reply + '\r\n').encode())
+                    self._last = time.monotonic()
+
+    def handle_line(self, line):
+        """Handle one command line.
+
+        :returns: the reply to send, or None if there's nothing to send
+        :rtype: str
+        """
+        with self._lock:
+            self.lines += 1
+            if time.monotonic() - self._last < self.quiet_time:
+                self.quiet_violations += 1
+                if self.strict:
+                    return None
+
+            replies = []
+            for command in line.split(';'):
+                command = command.strip()
+                if not command:
+                    continue
+                self.commands += 1
+                resp = self.handle_command(command)
+                if resp is not None:
+                    replies.append(resp)
+
+            if not replies:
+                return None
+            if self._drop > 0:
+                self._drop -= 1
+                return None
+            if random.random() < self.timeout_rate:
+                return None
+            return ';'.join(replies)
+
+    # Instrument
+
+    def _update_scan(self):
+        """Step the autoscanner along to where it would be by now."""
+        if not self.autoscan:
+            return
+        now = time.monotonic()
+        for _ in range(self.num_channels):
+            ch = str(self.scan_channel)
+            stay = int(self.inset[ch][1]) + int(self.inset[ch][2])
+            if now - self._scan_since < stay:
+                return
+            self._scan_since += stay
+            nxt = self.scan_channel
+            for _ in range(self.num_channels):
+                nxt = nxt % self.num_channels + 1
+                if self.inset[str(nxt)][0] == '1':
+                    break
+            self.scan_channel = nxt
+        # Fell behind by more than a whole scan, start over from now
+        self._scan_since = now
+
+    def resistance(self, channel):
+        """Simulated resistance of a channel, updated 10 times a second."""
+        n = 0 if channel == 'A' else int(channel)
+        tick = math.floor(time.time() * 10) / 10
+        return 1000.0 * (n + 1) * (1 + 1e-3 * math.sin(tick + n))
+
+    def kelvin(self, channel):
+        return 1e4 / self.resistance(channel)
+
+    def handle_command(self, command):
+        """Handle a single command.
+
+        :returns: the reply for queries, None otherwise
+        :rtype: str
+        """
+        header, _, rest = command.partition(' ')
+        header = header.upper()
+        if header == 'INNAME':
+            args = [a.strip().strip('"') for a in rest.split(',', 1)]
+        else:
+            args = [a for a in re.split(r'[,\s]+', rest.strip()) if a]
+
+        chan = args[0].upper() if args else None
+        if chan is not None and chan.isdigit():
+            chan = str(int(chan))
+
+        if header == '*IDN?':
+            return 'LSCI,MODEL372,FAKE372,1.0'
+        if header == 'SCAN?':
+            self._update_scan()
+            return f'{self.scan_channel:02d},{self.autoscan}'
+        if header == 'SCAN':
+            self.scan_channel = int(args[0])
+            self.autoscan = int(args[1])
+            self._scan_since = time.monotonic()
+            return None
+
+        if header == 'INSET?':
+            return ','.join(self.inset[chan])
+        if header == 'INSET':
+            self.inset[chan] = args[1:6]
+            return None
+        if header == 'INTYPE?':
+            return ','.join(self.intype[chan])
+        if header == 'INTYPE':
+            self.intype[chan] = args[1:7]
+            return None
+        if header == 'INNAME?':
+            return self.inname[chan]
+        if header == 'INNAME':
+            self.inname[chan] = args[1]
+            return None
+        if header == 'TLIMIT?':
+            return f'+{self.tlimit[chan]:.4f}'
+        if header == 'TLIMIT':
+            self.tlimit[chan] = float(args[1])
+            return None
+
+        if header in ['RDGR?', 'SRDG?']:
+            return f'{self.resistance(chan):+.5E}'
+        if header in ['RDGK?', 'KRDG?']:
+            return f'{self.kelvin(chan):+.5E}'
+        if header == 'RDGPWR?':
+            return f'{1e-15 * self.resistance(chan):+.5E}'
+        if header == 'RDGST?':
+            return '000'
+
+        if header == 'CRVHDR?':
+            return ','.join(self.curves.get(chan, {}).get('header', ['', '', '4', '0', '1']))
+        if header == 'CRVHDR':
+            self.curves.setdefault(chan, {'points': {}})['header'] = [a.strip('"') for a in args[1:6]]
+            return None
+        if header == 'CRVPT?':
+            units, kelvin = self.curves.get(chan, {}).get('points', {}).get(int(args[1]), (0.0, 0.0))
+            return f'{units:+.6g},{kelvin:+.6g},+0.00000'
+        if header == 'CRVPT':
+            self.curves.setdefault(chan, {'points': {}})['points'][int(args[1])] = \
+                (float(args[2]), float(args[3]))
+            return None
+        if header == 'CRVDEL':
+            self.curves.pop(chan, None)
+            for inset in self.inset.values():
+                if inset[3] == chan:
+                    inset[3] = '0'
+            return None
+
+        if header == 'HTRSET?':
+            return ','.join(self.htrset[chan])
+        if header == 'HTRSET':
+            self.htrset[chan] = args[1:5]
+            return None
+        if header == 'OUTMODE?':
+            return ','.join(self.outmode[chan])
+        if header == 'OUTMODE':
+            self.outmode[chan] = args[1:7]
+            return None
+        if header == 'RANGE?':
+            return self.range[chan]
+        if header == 'RANGE':
+            self.range[chan] = args[1]
+            return None
+        if header == 'MOUT?':
+            return f'{self.mout[chan]:+.5E}'
+        if header == 'MOUT':
+            self.mout[chan] = float(args[1])
+            return None
+        if header == 'HTR?':
+            return f'{self.mout["0"]:+.5E}'
+        if header == 'SETP?':
+            return f'{self.setp[chan]:+.5E}'
+        if header == 'SETP':
+            enabled, rate = self.ramp[chan]
+            if enabled == '1' and float(rate) > 0:
+                minutes = abs(float(args[1]) - self.setp[chan]) / float(rate)
+                self._ramp_until[chan] = time.monotonic() + 60 * minutes
+            self.setp[chan] = float(args[1])
+            return None
+        if header == 'RAMP?':
+            return ','.join(self.ramp[chan])
+        if header == 'RAMP':
+            self.ramp[chan] = args[1:3]
+            return None
+        if header == 'RAMPST?':
+            return str(int(time.monotonic() < self._ramp_until[chan]))
+        if header == 'PID?':
+            return ','.join(f'{v:+.1f}' for v in self.pid[chan or '0'])
+        if header == 'PID':
+            self.pid[chan] = [float(a) for a in args[1:4]]
+            return None
+        if header == 'STILL?':
+            return f'{self.still:+.3f}'
+        if header == 'STILL':
+            self.still = float(args[0])
+            return None
+
+        if header.endswith('?'):
+            return '0'
+        return None
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 7777
+    fake = Fake372(host='0.0.0.0', port=port).start()
+    print(f"Fake LS372 listening on port {fake.port}, Ctrl-C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        fake.stop()
@@ -1,8 +1,14 @@
 # Lakeshore372.py
 
+import os
 import sys
+import json
+import hashlib
+import queue
 import socket
+import threading
 import time
+from collections import namedtuple
 import numpy as np
 
 # Lookup keys for command parameters.
@@ -171,6 +177,17 @@ heater_display_key = { '1': 'current',
                 '2': 'power'}
 heater_display_lock = {v: k for k,v in heater_display_key.items()}
 
+# Reading queries and the dtype of their values, for LS372.read_many
+reading_queries = {'resistance': ('RDGR?', 'f8'),
+                   'kelvin': ('RDGK?', 'f8'),
+                   'sensor': ('SRDG?', 'f8'),
+                   'power': ('RDGPWR?', 'f8'),
+                   'status': ('RDGST?', 'i4')}
+
+# Configuration the 372 can change by itself, e.g. the heater range drops to
+# off on a fault. These are always written and never restored from snapshots.
+volatile_queries = ('RANGE?',)
+
 def _establish_socket_connection(ip, timeout, port=7777):
     """Establish socket connection to the LS372.
 
@@ -202,17 +219,294 @@ def _establish_socket_connection(ip, timeout, port=7777):
     return com
 
 
+class TokenBucket:
+    """Token bucket rate limiter.
+
+    Tokens accumulate at ``rate`` per second up to ``capacity``. Consuming a
+    token when none are available blocks only for as long as it takes for the
+    next one to accumulate. Taking more tokens than the bucket holds (e.g.
+    for a compound line of several readings) only waits for a full bucket and
+    leaves it in debt, so the next take waits for the rest: the long-run rate
+    stays at ``rate`` tokens per second.
+
+    :param rate: tokens added per second
+    :type rate: float
+    :param capacity: maximum number of tokens that can be saved up
+    :type capacity: float
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_update = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_update) * self.rate)
+        self.last_update = now
+
+    def delay(self, tokens=1):
+        """Time in seconds until ``tokens`` tokens (at most a full bucket) are
+        available."""
+        self._refill()
+        tokens = min(tokens, self.capacity)
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    def take(self, tokens=1):
+        """Take tokens from the bucket without waiting for them."""
+        self._refill()
+        self.tokens -= tokens
+
+    def consume(self, tokens=1):
+        """Take tokens from the bucket, sleeping until enough are available."""
+        wait = self.delay(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        self.take(tokens)
+
+
+class Pacer:
+    """Inter-command pacing for the LS372.
+
+    The 372 ignores commands that arrive too soon after the previous one (the
+    manual asks for 50 ms, 61 ms was found to be reliable by trial & error),
+    and only updates its readings at 10 readings/s (pg 34). Rather than
+    sleeping a fixed time after every message, we remember when the line went
+    quiet and only wait for whatever part of the quiet time is left, and we
+    budget reading queries with a token bucket, one token per reading query
+    even when several are packed into one compound line.
+
+    :param quiet_time: minimum time in seconds between the end of one
+                       exchange and the next command
+    :type quiet_time: float
+    :param reading_rate: maximum number of reading queries per second
+    :type reading_rate: float
+    """
+    def __init__(self, quiet_time=0.061, reading_rate=10):
+        self.quiet_time = quiet_time
+        self.readings = TokenBucket(reading_rate)
+        self.last_command = -float('inf')
+
+    def delay(self, readings=0):
+        """Time in seconds until the next command may be sent.
+
+        :param readings: number of reading queries in the next command line,
+                         which also have to fit in the reading rate budget
+        :type readings: int
+        """
+        wait = max(0.0, self.last_command + self.quiet_time - time.monotonic())
+        if readings:
+            wait = max(wait, self.readings.delay(readings))
+        return wait
+
+    def wait(self, readings=0):
+        """Block until the next command may be sent, then claim its slot.
+
+        :param readings: number of reading queries in the next command line
+        :type readings: int
+        """
+        wait = self.delay(readings)
+        if wait > 0:
+            time.sleep(wait)
+        self.sent(readings)
+
+    def sent(self, readings=0):
+        """Record that a command is being sent, without waiting."""
+        if readings:
+            self.readings.take(readings)
+
+    @staticmethod
+    def count_readings(message):
+        """Number of reading queries in a (possibly compound) command line."""
+        return sum('RDG' in command for command in message.split(';'))
+
+    def mark(self):
+        """Record that the line just went quiet."""
+        self.last_command = time.monotonic()
+
+
+def read_curve_file(_file):
+    """Read a calibration curve file (.340 format, as written by Curve.get_curve).
+
+    :param _file: the file to load the calibration curve from
+    :type _file: str
+
+    :returns: header (name, serial number, format, limit, coefficient) and the
+              breakpoints, with fields 'index', 'units' and 'temperature'
+    :rtype: list of str, numpy structured array
+    """
+    with open(_file) as f:
+        content = f.readlines()
+
+    header = []
+    for i in range(0, 5):
+        if i < 2:
+            header.append(content[i].strip().split(":", 1)[1].strip())
+        else:
+            header.append(content[i].strip().split(":", 1)[1].strip().split("(", 1)[0].strip())
+
+    # Skip to the breakpoints and parse them all at once
+    values = np.loadtxt(content[9:], ndmin=2)
+    breakpoints = np.zeros(len(values), dtype=[('index', 'i4'), ('units', 'f8'),
+                                               ('temperature', 'f8')])
+    breakpoints['index'] = values[:, 0]
+    breakpoints['units'] = values[:, 1]
+    breakpoints['temperature'] = values[:, 2]
+
+    return header, breakpoints
+
+
+def resistance_to_temperature(resistance, breakpoints, curve_format="Ohm/K (linear)",
+                              method='curve'):
+    """Convert resistances to temperatures with a calibration curve, offline.
+
+    Works on arrays of any size, so logged resistances can be converted
+    without going back to the instrument.
+
+    Methods:
+        'curve' - interpolate the way the 372 does for the curve's format:
+                  linear in Ohms, linear in log10(Ohms), or a cubic spline
+        'loglog' - piecewise linear in log(R) vs log(T)
+        'spline' - cubic spline in log(R) vs log(T)
+
+    The cubic spline methods need scipy.
+
+    :param resistance: resistances in Ohms
+    :type resistance: float or array
+    :param breakpoints: calibration curve, with fields 'units' and
+                        'temperature', as from Curve.get_curve() or
+                        read_curve_file()
+    :type breakpoints: numpy structured array
+    :param curve_format: format of the curve, one of the values of format_key.
+                         For "log Ohm/K (linear)" the units are log10(Ohms).
+    :type curve_format: str
+    :param method: 'curve', 'loglog' or 'spline'
+    :type method: str
+
+    :returns: temperatures in Kelvin, NaN where the resistance is outside the
+              curve
+    :rtype: float or array
+    """
+    assert curve_format in format_lock, f"{curve_format} not a valid curve format"
+    assert method in ['curve', 'loglog', 'spline'], f"{method} not a valid method"
+
+    units = np.asarray(breakpoints['units'], dtype=float)
+    temps = np.asarray(breakpoints['temperature'], dtype=float)
+    if curve_format == "log Ohm/K (linear)":
+        units = 10 ** units
+
+    order = np.argsort(units)
+    units = units[order]
+    temps = temps[order]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.asarray(resistance, dtype=float)
+
+        if method == 'curve' and curve_format == "Ohm/K (linear)":
+            return np.interp(r, units, temps, left=np.nan, right=np.nan)
+        if method == 'curve' and curve_format == "log Ohm/K (linear)":
+            return np.interp(np.log10(r), np.log10(units), temps, left=np.nan, right=np.nan)
+        if method == 'loglog':
+            return 10 ** np.interp(np.log10(r), np.log10(units), np.log10(temps),
+                                   left=np.nan, right=np.nan)
+
+        try:
+            from scipy.interpolate import CubicSpline
+        except ImportError:
+            raise ImportError("Cubic spline interpolation needs scipy")
+
+        if method == 'curve':
+            return CubicSpline(units, temps, extrapolate=False)(r)
+        return 10 ** CubicSpline(np.log10(units), np.log10(temps), extrapolate=False)(np.log10(r))
+
+
+class LazyAttribute:
+    """Instrument setting that is only queried on first access.
+
+    Accessing the attribute calls the named refresh method (e.g.
+    Channel.get_input_setup), which stores the value on the instance as usual.
+    From then on normal attribute lookup finds the stored value and the
+    instrument isn't asked again. Deleting the attribute from the instance
+    makes it lazy again.
+
+    :param refresh: name of the method that queries and stores the value
+    :type refresh: str
+    """
+    def __init__(self, refresh):
+        self.refresh = refresh
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        getattr(instance, self.refresh)()
+        return instance.__dict__[self.name]
+
+    @staticmethod
+    def forget(instance, refresh):
+        """Drop the stored values of all lazy attributes of instance fetched by
+        the named refresh method."""
+        for name, attr in vars(type(instance)).items():
+            if isinstance(attr, LazyAttribute) and attr.refresh == refresh:
+                instance.__dict__.pop(name, None)
+
+
+class StateCache:
+    """Client-side cache of the LS372's configuration.
+
+    Holds the last known raw reply to each configuration query (INSET?,
+    INTYPE?, OUTMODE?, HTRSET?, ...), keyed by query. Invalidated entries are
+    marked dirty and aren't returned until they've been queried again.
+    """
+    def __init__(self):
+        self.values = {}
+        self.dirty = set()
+
+    def get(self, query):
+        """Cached reply to query, or None if unknown or dirty."""
+        if query in self.dirty:
+            return None
+        return self.values.get(query)
+
+    def set(self, query, resp):
+        self.values[query] = resp
+        self.dirty.discard(query)
+
+    def invalidate(self, prefix=''):
+        """Mark all queries starting with prefix as dirty."""
+        self.dirty.update(q for q in self.values if q.startswith(prefix))
+
+
 class LS372:
     """
         Lakeshore 372 class.
 
+    Channel and heater settings are fetched lazily, on first access. Use
+    refresh_channels() to fetch them all with a few batched queries, and
+    save_snapshot()/the snapshot argument to warm-start from a previous run.
+
     Attributes:
         channels - list of channels, index corresponds to channel number with
                    index 0 corresponding to the control channel, 'A'
     """
-    def __init__(self, ip, timeout=10, num_channels=16):
-        self.com = _establish_socket_connection(ip, timeout)
+    # Longest line we'll build when packing several queries into one command
+    max_command_length = 64
+
+    def __init__(self, ip, timeout=10, num_channels=16, port=7777,
+                 quiet_time=0.061, reading_rate=10, snapshot=None):
+        self.com = _establish_socket_connection(ip, timeout, port)
         self.num_channels = num_channels
+        self.pacer = Pacer(quiet_time, reading_rate)
+        self.lock = threading.RLock()
+        self._rx_buffer = b''
+        # Raw replies to configuration queries, keyed by query
+        self.state = StateCache()
+        self._reconcile_stop = threading.Event()
+        self._reconcile_thread = None
 
         self.id = self.get_id()
         self.autoscan = self.get_autoscan()
@@ -233,6 +527,9 @@ class LS372:
         self.sample_heater = Heater(self, 0)
         self.still_heater = Heater(self, 2)
 
+        if snapshot is not None:
+            self.load_snapshot(snapshot)
+
     def msg(self, message):
         """Send message to the Lakeshore 372 over ethernet.
 
@@ -240,6 +537,14 @@ class LS372:
         the message string), then we will attempt to ask twice before giving up
         due to potential communication timeouts.
 
+        Pacing is handled by self.pacer: we only wait for whatever is left of
+        the instrument's quiet time since the last exchange, reading queries
+        are limited to 10 readings/s, and replies are read as soon as their
+        terminator arrives.
+
+        Safe to call from several threads, e.g. while an AutoscanSampler is
+        running.
+
         Parameters
         ----------
         message : str
@@ -251,32 +556,335 @@ class LS372:
             Response string from the Lakeshore, if any. Else, an empty string.
 
         """
+        with self.lock:
+            return self._exchange(message)
+
+    def _exchange(self, message):
         msg_str = f'{message}\r\n'.encode()
 
+        self.pacer.wait(self.pacer.count_readings(message))
+
         if '?' in message:
             self.com.send(msg_str)
             # Try once, if we timeout, try again. Usually gets around single event glitches.
             for attempt in range(2):
                 try:
-                    time.sleep(0.061)
-                    resp = str(self.com.recv(4096), 'utf-8').strip()
+                    resp = self._read_line()
                     break
                 except socket.timeout:
                     print("Warning: Caught timeout waiting for response to '%s', trying again " \
                           "before giving up"%message)
                     if attempt == 1:
+                        self.pacer.mark()
                         raise RuntimeError('Query response to Lakeshore timed out after two ' \
                                            'attempts. Check connection.')
         else:
             self.com.send(msg_str)
             resp = ''
 
-        if 'RDG' in message:
-            time.sleep(0.1)  # Instrument sampling rate of 10 readings/s max (pg 34)
-        else:
-            time.sleep(0.061)  # No comms for 61ms after sending message after trial & error (manual says50ms)
+        self.pacer.mark()
         return resp
 
+    def _read_line(self):
+        """Read from the socket until a full terminated reply has arrived.
+
+        Only the newly received bytes are searched for the terminator. Anything
+        received after the terminator is kept for the next reply.
+
+        :returns: the reply, stripped of its terminator
+        :rtype: str
+        """
+        end = self._rx_buffer.find(b'\n')
+        while end == -1:
+            chunk = self.com.recv(4096)
+            if chunk == b'':
+                raise ConnectionError("LS372 closed the connection")
+            start = len(self._rx_buffer)
+            self._rx_buffer += chunk
+            end = self._rx_buffer.find(b'\n', start)
+        line, self._rx_buffer = self._rx_buffer[:end], self._rx_buffer[end + 1:]
+        return str(line, 'utf-8').strip()
+
+    def query_many(self, queries):
+        """Send several queries, packed into as few command lines as possible.
+
+        Queries are joined with ';' into lines of at most
+        max_command_length characters, and the 372 answers each line with
+        the replies joined by ';'.
+
+        :param queries: query strings, e.g. ['INSET? 1', 'INTYPE? 1']
+        :type queries: list of str
+
+        :returns: one reply per query, in order
+        :rtype: list of str
+        """
+        replies = []
+        for line in self._pack_lines([[q] for q in queries]):
+            replies += self._query_line(line)
+
+        return replies
+
+    def _pack_lines(self, groups):
+        """Pack groups of queries into command lines.
+
+        Queries in the same group always end up on the same line, lines are
+        kept under max_command_length where possible.
+
+        :param groups: lists of query strings
+        :type groups: list of list of str
+
+        :returns: lists of queries, one per command line
+        :rtype: list of list of str
+        """
+        lines = []
+        line = []
+        for group in groups:
+            if line and len(';'.join(line + group)) > self.max_command_length:
+                lines.append(line)
+                line = []
+            line = line + group
+        if line:
+            lines.append(line)
+
+        return lines
+
+    def _query_line(self, queries):
+        resp = self.msg(';'.join(queries)).split(';')
+        if len(resp) != len(queries):
+            raise RuntimeError(f"Expected {len(queries)} replies to '{';'.join(queries)}', "
+                               f"got {len(resp)}")
+        return [r.strip() for r in resp]
+
+    def read_many(self, channels=None, quantities=('resistance', 'power')):
+        """Read several quantities from several channels in a few round trips.
+
+        All queries for a channel are sent in the same compound command line,
+        and as many channels as fit are packed into each line, so a full 16
+        channel snapshot takes a handful of messages instead of one per
+        reading. Each reading still counts against the pacer's reading rate.
+
+        :param channels: channel numbers to read (0 or 'A' for the control
+                         input), defaults to all measurement channels
+        :type channels: list of int
+        :param quantities: any of 'resistance', 'kelvin', 'sensor', 'power',
+                           'status'
+        :type quantities: tuple of str
+
+        :returns: one record per channel with fields 'channel', 'time' (unix
+                  time at which the reply arrived) and one per quantity.
+                  'status' is the raw RDGST? bit field.
+        :rtype: numpy structured array
+        """
+        if channels is None:
+            channels = range(1, self.num_channels + 1)
+        channels = [0 if c == 'A' else int(c) for c in channels]
+
+        for q in quantities:
+            assert q in reading_queries, f"{q} not one of {list(reading_queries)}"
+
+        dtype = [('channel', 'i4'), ('time', 'f8')] + [(q, reading_queries[q][1]) for q in quantities]
+        readings = np.zeros(len(channels), dtype=dtype)
+        readings['channel'] = channels
+
+        groups = []
+        for chan in channels:
+            c = 'A' if chan == 0 else chan
+            groups.append([f"{reading_queries[q][0]} {c}" for q in quantities])
+
+        i = 0
+        for line in self._pack_lines(groups):
+            resp = self._query_line(line)
+            now = time.time()
+            for j in range(0, len(resp), len(quantities)):
+                readings[i]['time'] = now
+                for q, r in zip(quantities, resp[j:j + len(quantities)]):
+                    readings[i][q] = float(r)
+                i += 1
+
+        return readings
+
+    def _config_query(self, query):
+        """Run a configuration query, keeping its raw reply in the state cache."""
+        resp = self.msg(query)
+        self.state.set(query, resp)
+        return resp
+
+    def _cached_params(self, query, refresh):
+        """Last known reply to a configuration query, split into parameters.
+
+        Only asks the LS372 (by calling refresh) if the reply isn't cached or
+        has been invalidated.
+        """
+        resp = self.state.get(query)
+        if resp is None:
+            return refresh()
+        return resp.split(',')
+
+    def _write_config(self, command, query, params, parser):
+        """Write-through for configuration setters.
+
+        Sends "command params" unless params are the same as the cached reply
+        to query, in which case nothing is sent at all. Afterwards the cache
+        and the object's attributes (via parser) hold the new values.
+
+        :returns: response from ls.msg, or an empty string if nothing was sent
+        :rtype: str
+        """
+        params = [str(p).strip() for p in params]
+        # Held until the cache is updated, so reconcile() can't slip a stale
+        # reply in between
+        with self.lock:
+            cached = self.state.get(query)
+            if cached is not None and [p.strip() for p in cached.split(',')] == params:
+                return ''
+
+            value = ','.join(params)
+            try:
+                resp = self.msg(f"{command},{value}")
+            except Exception:
+                self.invalidate_cache(query)
+                raise
+
+            self.state.set(query, value)
+            parser(value)
+            return resp
+
+    def invalidate_cache(self, prefix=''):
+        """Forget cached settings, so they're queried again when next needed.
+
+        :param prefix: only invalidate queries starting with this, e.g.
+                       'INSET?' or 'INTYPE? 3'. Defaults to everything.
+        :type prefix: str
+        """
+        self.state.invalidate(prefix)
+        for obj in self._configurables():
+            for query, (parser, refresh) in obj._config_queries().items():
+                if query.startswith(prefix):
+                    LazyAttribute.forget(obj, refresh)
+
+    def reconcile(self):
+        """Re-query all cached settings and update any that have changed,
+        e.g. from the front panel.
+
+        The lock is held from the queries to the cache update, so a setter
+        running in another thread can't be overwritten with a stale reply.
+
+        :returns: queries whose replies changed
+        :rtype: list of str
+        """
+        parsers = {}
+        for obj in self._configurables():
+            for query, (parser, refresh) in obj._config_queries().items():
+                parsers[query] = parser
+
+        with self.lock:
+            queries = [q for q in self.state.values if q in parsers]
+            changed = []
+            for query, resp in zip(queries, self.query_many(queries)):
+                if self.state.values[query] != resp or query in self.state.dirty:
+                    changed.append(query)
+                    parsers[query](resp)
+                self.state.set(query, resp)
+
+        return changed
+
+    def start_reconciliation(self, interval=60):
+        """Reconcile the state cache in a background thread every interval seconds.
+
+        :param interval: time between reconciliations in seconds
+        :type interval: float
+        """
+        self.stop_reconciliation()
+        self._reconcile_stop.clear()
+
+        def run():
+            while not self._reconcile_stop.wait(interval):
+                changed = self.reconcile()
+                if changed:
+                    print("LS372 settings changed outside of this session: %s" % changed)
+
+        self._reconcile_thread = threading.Thread(target=run, daemon=True)
+        self._reconcile_thread.start()
+
+    def stop_reconciliation(self):
+        """Stop background reconciliation of the state cache."""
+        self._reconcile_stop.set()
+        if self._reconcile_thread is not None:
+            self._reconcile_thread.join()
+            self._reconcile_thread = None
+
+    def _configurables(self):
+        return self.channels + [self.sample_heater, self.still_heater]
+
+    def refresh_channels(self, channels=None):
+        """Fetch the configuration of several channels in batched queries.
+
+        INSET?, INTYPE?, INNAME? and TLIMIT? for each channel are packed into
+        compound command lines, instead of one round trip per query.
+
+        :param channels: channel numbers to refresh, defaults to all
+        :type channels: list of int or str
+        """
+        if channels is None:
+            chans = self.channels
+        else:
+            chans = [self.channels[0 if c == 'A' else int(c)] for c in channels]
+
+        parsers = {}
+        for chan in chans:
+            for query, (parser, refresh) in chan._config_queries().items():
+                parsers[query] = parser
+
+        queries = list(parsers)
+        for query, resp in zip(queries, self.query_many(queries)):
+            self.state.set(query, resp)
+            parsers[query](resp)
+
+    def save_snapshot(self, path):
+        """Save the last known configuration to disk.
+
+        Only settings that have already been fetched are saved, call
+        refresh_channels() first for a complete snapshot.
+
+        :param path: json file to write
+        :type path: str
+        """
+        config = {query: resp for query, resp in self.state.values.items()
+                  if not query.startswith(volatile_queries)}
+        with open(path, 'w') as f:
+            json.dump({'id': self.id, 'config': config}, f, indent=1)
+
+    def load_snapshot(self, path):
+        """Warm-start channel and heater settings from a saved snapshot.
+
+        The snapshot is ignored if it doesn't exist or was taken on a
+        different instrument. Settings missing from the snapshot stay lazy.
+        Note that changes made since the snapshot was taken (e.g. on the front
+        panel) won't be seen until the settings are queried again.
+
+        :param path: json file written by save_snapshot()
+        :type path: str
+
+        :returns: whether the snapshot was used
+        :rtype: bool
+        """
+        if not os.path.isfile(path):
+            return False
+
+        with open(path) as f:
+            snapshot = json.load(f)
+
+        if snapshot.get('id') != self.id:
+            return False
+
+        for obj in self._configurables():
+            for query, (parser, refresh) in obj._config_queries().items():
+                if query in snapshot['config'] and not query.startswith(volatile_queries):
+                    self.state.set(query, snapshot['config'][query])
+                    parser(snapshot['config'][query])
+
+        return True
+
     def get_id(self):
         """Get the ID number of the Lakeshore unit."""
         return self.msg('*IDN?')
@@ -368,6 +976,18 @@ class LS372:
         idx = channel_list.index(channel_number)
         return self.channels[idx]
 
+    def sample_autoscan(self, quantity='resistance', settle=0, interval=None):
+        """Start an AutoscanSampler following the scanner.
+
+        See AutoscanSampler for the parameters.
+
+        :returns: the running sampler, iterate over it to get readings
+        :rtype: AutoscanSampler
+        """
+        sampler = AutoscanSampler(self, quantity, settle, interval)
+        sampler.start()
+        return sampler
+
     def set_active_channel(self, channel):
         """Set the active scanner channel.
 
@@ -391,6 +1011,290 @@ class LS372:
         pass
 
 
+Reading = namedtuple('Reading', ['time', 'channel', 'value'])
+
+
+class AutoscanSampler:
+    """Background sampler that follows the LS372 scanner.
+
+    The 372 has a single measurement input multiplexed across its channels,
+    so only the currently scanned channel has a fresh reading. The sampler
+    asks SCAN? together with the reading of the channel it thinks is active,
+    in one compound query. When the scanner moves on, it waits out the new
+    channel's pause time (plus settle) before taking readings, and readings
+    identical to the previous one (the instrument hasn't updated yet) are
+    dropped. Readings are only taken at the instrument's reading rate, or
+    every interval seconds if given.
+
+    Iterate over the sampler to get Reading(time, channel, value) tuples::
+
+        with ls.sample_autoscan() as sampler:
+            for reading in sampler:
+                print(reading)
+
+    :param ls: Lakeshore unit for communication
+    :type ls: LS372 Object
+    :param quantity: 'resistance', 'kelvin', 'sensor' or 'power'
+    :type quantity: str
+    :param settle: extra time in seconds to wait after the pause time
+    :type settle: float
+    :param interval: minimum time in seconds between readings, defaults to
+                     the pacer's reading rate
+    :type interval: float
+    """
+    def __init__(self, ls, quantity='resistance', settle=0, interval=None):
+        assert quantity in ['resistance', 'kelvin', 'sensor', 'power']
+
+        self.ls = ls
+        self.query = reading_queries[quantity][0]
+        self.settle = settle
+        self.interval = interval
+        self.readings = queue.Queue()
+        self.error = None
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start sampling in a background thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling, readings already taken can still be iterated over."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        try:
+            channel = int(self.ls.msg("SCAN?").split(',')[0])
+            switched = time.time()
+            last = None
+
+            while not self._stop.is_set():
+                # Don't ask for readings until the channel's pause has elapsed
+                ready = switched + self.ls.channels[channel].pause + self.settle
+                if self._stop.wait(max(0, ready - time.time())):
+                    break
+
+                resp = self.ls.msg(f"SCAN?;{self.query} {channel}").split(';')
+                now = time.time()
+                active = int(resp[0].split(',')[0])
+
+                if active != channel:
+                    # Scanner moved on, the reading belongs to the old channel
+                    channel = active
+                    switched = now
+                    last = None
+                    continue
+
+                value = float(resp[1])
+                if value != last:
+                    self.readings.put(Reading(now, channel, value))
+                    last = value
+
+                if self.interval is not None:
+                    self._stop.wait(self.interval)
+        except Exception as e:
+            self.error = e
+
+    def __iter__(self):
+        while self.running or not self.readings.empty():
+            try:
+                yield self.readings.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        if not self.running:
+            self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+Step = namedtuple('Step', ['value', 'start', 'end', 'settled', 'readings'])
+
+
+class HeaterScheduler:
+    """Step a heater through a list of values, moving on as soon as the stage
+    has settled instead of after a fixed wait.
+
+    For each step the setpoint (mode 'setpoint') or the manual output (mode
+    'output') is set, then the channel is read every interval seconds. Once
+    there's a full window of readings since the step started, and any setpoint
+    ramp has finished, the step is settled when the slope of a straight line
+    fit to the window is below slope and the standard deviation of the window
+    is below std. Either criterion can be left out. A step that hasn't settled
+    after timeout seconds is given up on and the sweep moves to the next one.
+
+    Only the scanned channel has fresh readings, so watch the control input
+    or a channel with autoscan off.
+
+    Iterate over the scheduler to run the sweep, getting a Step(value, start,
+    end, settled, readings) per step::
+
+        sweep = HeaterScheduler(ls.sample_heater, ls.channels[6], [0.05, 0.1],
+                                slope=1e-6, window=120, timeout=1800)
+        for step in sweep:
+            print(step.value, step.settled, step.readings[-1].value)
+
+    :param heater: heater to step
+    :type heater: Heater
+    :param channel: channel to watch for settling
+    :type channel: Channel
+    :param values: setpoints, or outputs as for Heater.set_heater_output
+    :type values: list of float
+    :param mode: 'setpoint' or 'output'
+    :type mode: str
+    :param quantity: 'kelvin', 'resistance' or 'sensor'
+    :type quantity: str
+    :param slope: largest slope over the window that counts as settled, in
+                  quantity units per second
+    :type slope: float
+    :param std: largest standard deviation over the window that counts as
+                settled, in quantity units
+    :type std: float
+    :param window: length of the stability window in seconds
+    :type window: float
+    :param timeout: most time in seconds to spend on one step
+    :type timeout: float
+    :param interval: time in seconds between readings
+    :type interval: float
+    :param ramp_rate: if given, setpoints are ramped at this rate in K/min
+    :type ramp_rate: float
+    """
+    def __init__(self, heater, channel, values, mode='setpoint', quantity='kelvin', slope=None,
+                 std=None, window=60, timeout=900, interval=1, ramp_rate=None):
+        assert mode in ['setpoint', 'output'], f"{mode} not a valid mode"
+        assert quantity in ['kelvin', 'resistance', 'sensor'], f"{quantity} not a valid quantity"
+        assert slope is not None or std is not None, "Need a slope or std stability criterion"
+        assert ramp_rate is None or mode == 'setpoint', "Only setpoints can be ramped"
+
+        self.heater = heater
+        self.channel = channel
+        self.values = list(values)
+        self.mode = mode
+        self.query = f"{reading_queries[quantity][0]} {channel.channel_num}"
+        self.slope = slope
+        self.std = std
+        self.window = window
+        self.timeout = timeout
+        self.interval = interval
+        self.ramp_rate = ramp_rate
+
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Stop the sweep after the next reading, e.g. from another thread."""
+        self._stop.set()
+
+    def settled(self, readings):
+        """Check the stability criteria against a window of readings.
+
+        :param readings: readings in the window
+        :type readings: list of Reading
+
+        :returns: whether the readings meet all given criteria
+        :rtype: bool
+        """
+        if len(readings) < 2:
+            return False
+
+        t = np.array([r.time for r in readings])
+        y = np.array([r.value for r in readings])
+
+        if self.slope is not None and abs(np.polyfit(t - t[0], y, 1)[0]) >= self.slope:
+            return False
+        if self.std is not None and np.std(y) >= self.std:
+            return False
+        return True
+
+    def run_step(self, value):
+        """Set one value and wait for the stage to settle.
+
+        :param value: setpoint or output
+        :type value: float
+
+        :returns: the step and the readings taken during it
+        :rtype: Step
+        """
+        if self.mode == 'setpoint':
+            self.heater.set_setpoint(value)
+        elif not self.heater.set_heater_output(value):
+            raise RuntimeError(f"Could not set heater output to {value}")
+
+        ls = self.heater.ls
+        ramping = self.ramp_rate is not None
+        start = window_start = time.time()
+        readings = []
+        settled = False
+
+        while not self._stop.is_set():
+            if ramping:
+                resp = ls.msg(f"{self.query};RAMPST? {self.heater.output}").split(';')
+                ramping = bool(int(resp[1]))
+            else:
+                resp = [ls.msg(self.query)]
+            now = time.time()
+            readings.append(Reading(now, self.channel.channel_num, float(resp[0])))
+
+            if ramping:
+                # The window only starts once the setpoint stops moving
+                window_start = now
+            elif now - window_start >= self.window:
+                settled = self.settled([r for r in readings if r.time >= now - self.window])
+                if settled:
+                    break
+
+            if now - start >= self.timeout:
+                print(f"Warning: {value} didn't settle within {self.timeout} s, moving on")
+                break
+
+            self._stop.wait(self.interval)
+
+        return Step(value, start, time.time(), settled, readings)
+
+    def __iter__(self):
+        self._stop.clear()
+        if self.ramp_rate is None:
+            yield from self._steps()
+            return
+
+        # Put the ramp back as it was once the sweep is over, or given up on
+        enabled, rate = self.heater._get_ramp()
+        self.heater.set_ramp_rate(self.ramp_rate)
+        self.heater.enable_ramp()
+        try:
+            yield from self._steps()
+        finally:
+            self.heater.ls.msg(f"RAMP {self.heater.output},{int(enabled)},{rate}")
+
+    def _steps(self):
+        for value in self.values:
+            yield self.run_step(value)
+            if self._stop.is_set():
+                break
+
+    def run(self):
+        """Run the whole sweep.
+
+        :returns: one Step per value
+        :rtype: list of Step
+        """
+        return list(self)
+
+
 class Channel:
     """Lakeshore 372 Channel Object
 
@@ -399,15 +1303,40 @@ class Channel:
     :param channel_num: The channel number (1-8 or 1-16 depending on scanner
                         type)
     :type channel_num: int
+
+    Settings are fetched from the LS372 the first time they're accessed.
     """
+    # INSET?
+    enabled = LazyAttribute('get_input_channel_parameter')
+    dwell = LazyAttribute('get_input_channel_parameter')
+    pause = LazyAttribute('get_input_channel_parameter')
+    curve_num = LazyAttribute('get_input_channel_parameter')
+    tempco = LazyAttribute('get_input_channel_parameter')
+    # INTYPE?
+    mode = LazyAttribute('get_input_setup')
+    excitation = LazyAttribute('get_input_setup')
+    excitation_units = LazyAttribute('get_input_setup')
+    autorange = LazyAttribute('get_input_setup')
+    range = LazyAttribute('get_input_setup')
+    csshunt = LazyAttribute('get_input_setup')
+    units = LazyAttribute('get_input_setup')
+    # INNAME?
+    name = LazyAttribute('get_sensor_input_name')
+    # TLIMIT?
+    tlimit = LazyAttribute('get_temperature_limit')
+
     def __init__(self, ls, channel_num):
         self.ls = ls
         self.channel_num = channel_num
-        self.enabled = False
-        self.get_input_channel_parameter()
-        self.get_sensor_input_name()
-        self.get_input_setup()
-        self.tlimit = self.get_temperature_limit()
+
+    def _config_queries(self):
+        """Configuration queries for this channel, with their reply parsers and
+        the refresh methods of the lazy attributes they set."""
+        return {f"INSET? {self.channel_num}": (self._parse_input_channel_parameter,
+                                               'get_input_channel_parameter'),
+                f"INTYPE? {self.channel_num}": (self._parse_input_setup, 'get_input_setup'),
+                f"INNAME? {self.channel_num}": (self._parse_sensor_input_name, 'get_sensor_input_name'),
+                f"TLIMIT? {self.channel_num}": (self._parse_temperature_limit, 'get_temperature_limit')}
 
     def get_input_channel_parameter(self):
         """Run Input Channel Parameter Query
@@ -432,7 +1361,11 @@ class Channel:
 
         Reference: LakeShore 372 Manual - pg177
         """
-        resp = self.ls.msg(f"INSET? {self.channel_num}").split(',')
+        return self._parse_input_channel_parameter(
+            self.ls._config_query(f"INSET? {self.channel_num}"))
+
+    def _parse_input_channel_parameter(self, resp):
+        resp = resp.split(',')
 
         self.enabled = bool(int(resp[0]))
         self.dwell = int(resp[1])  # seconds
@@ -450,6 +1383,8 @@ class Channel:
         allows us to use output from get_input_channel_parameters directly, as
         it doesn't return <input/channel>.
 
+        Nothing is sent if the parameters match the state cache.
+
         :param params: INSET parameters
         :type params: list of str
 
@@ -457,11 +1392,13 @@ class Channel:
         """
         assert len(params) == 5
 
-        reply = [str(self.channel_num)]
-        [reply.append(x) for x in params]
+        return self.ls._write_config(f"INSET {self.channel_num}", f"INSET? {self.channel_num}",
+                                     params, self._parse_input_channel_parameter)
 
-        param_str = ','.join(reply)
-        return self.ls.msg(f"INSET {param_str}")
+    def _cached_input_channel_parameter(self):
+        """INSET parameters from the state cache, only queried if unknown."""
+        return self.ls._cached_params(f"INSET? {self.channel_num}",
+                                      self.get_input_channel_parameter)
 
     def get_input_setup(self):
         """Run Input Setup Query, storing results in human readable format.
@@ -497,7 +1434,11 @@ class Channel:
 
         Reference: LakeShore 372 Manual - pg178-179
         """
-        resp = self.ls.msg(f"INTYPE? {self.channel_num}").split(',')
+        return self._parse_input_setup(
+            self.ls._config_query(f"INTYPE? {self.channel_num}"))
+
+    def _parse_input_setup(self, resp):
+        resp = resp.split(',')
 
         _mode = resp[0]
         _excitation = resp[1]
@@ -545,7 +1486,8 @@ class Channel:
         """Set INTYPE.
 
         Parameters are <mode>, <excitation>, <autorange>, <range>, <cs shunt>,
-        <units>. Will determine <input/channel> from attributes.
+        <units>. Will determine <input/channel> from attributes. Nothing is
+        sent if the parameters match the state cache.
 
         :param params: INTYPE parameters
         :type params: list of str
@@ -554,11 +1496,12 @@ class Channel:
         """
         assert len(params) == 6
 
-        reply = [str(self.channel_num)]
-        [reply.append(x) for x in params]
+        return self.ls._write_config(f"INTYPE {self.channel_num}", f"INTYPE? {self.channel_num}",
+                                     params, self._parse_input_setup)
 
-        param_str = ','.join(reply)
-        return self.ls.msg(f"INTYPE {param_str}")
+    def _cached_input_setup(self):
+        """INTYPE parameters from the state cache, only queried if unknown."""
+        return self.ls._cached_params(f"INTYPE? {self.channel_num}", self.get_input_setup)
 
     # Public API
 
@@ -585,7 +1528,7 @@ class Channel:
         """
         assert excitation_mode in ['voltage', 'current']
 
-        resp = self.get_input_setup()
+        resp = self._cached_input_setup()
         resp[0] = mode_lock[excitation_mode]
 
         self.mode = mode_key[resp[0]]
@@ -653,21 +1596,21 @@ class Channel:
 
         closest_value = min(excitation_lock, key=lambda x: abs(x-excitation_value))
 
-        resp = self.get_input_setup()
+        resp = self._cached_input_setup()
         resp[1] = str(excitation_lock[closest_value])
 
         return self._set_input_setup(resp)
 
     def enable_autorange(self):
         """Enable auto range for channel via INTYPE command."""
-        resp = self.get_input_setup()
+        resp = self._cached_input_setup()
         resp[2] = '1'
         self.autorange = autorange_key[resp[2]]
         return self._set_input_setup(resp)
 
     def disable_autorange(self):
         """Disable auto range for channel via INTYPE command."""
-        resp = self.get_input_setup()
+        resp = self._cached_input_setup()
         resp[2] = '0'
         self.autorange = autorange_key[resp[2]]
         return self._set_input_setup(resp)
@@ -695,7 +1638,7 @@ class Channel:
 
         _range = get_closest_resistance_range(resistance_range)
 
-        resp = self.get_input_setup()
+        resp = self._cached_input_setup()
         resp[3] = str(range_lock[_range])
         self.range = _range
         return self._set_input_setup(resp)
@@ -717,7 +1660,7 @@ class Channel:
         :returns: state of excitation
         :rtype: str
         """
-        resp = self.get_input_setup()
+        resp = self._cached_input_setup()
         resp[4] = '0'
         self.csshunt = csshunt_key[resp[4]]
         return self._set_input_setup(resp)
@@ -728,7 +1671,7 @@ class Channel:
         :returns: state of excitation
         :rtype: str
         """
-        resp = self.get_input_setup()
+        resp = self._cached_input_setup()
         resp[4] = '1'
         self.csshunt = csshunt_key[resp[4]]
         return self._set_input_setup(resp)
@@ -755,7 +1698,7 @@ class Channel:
         """
         assert units.lower() in ['kelvin', 'ohms']
 
-        resp = self.get_input_setup()
+        resp = self._cached_input_setup()
         resp[5] = units_lock[units.lower()]
         return self._set_input_setup(resp)
 
@@ -777,7 +1720,7 @@ class Channel:
         :returns: response from self._set_input_channel_parameter()
         :rtype: str
         """
-        resp = self.get_input_channel_parameter()
+        resp = self._cached_input_channel_parameter()
         resp[0] = '1'
         self.enabled = True
         return self._set_input_channel_parameter(resp)
@@ -788,7 +1731,7 @@ class Channel:
         :returns: response from self._set_input_channel_parameter()
         :rtype: str
         """
-        resp = self.get_input_channel_parameter()
+        resp = self._cached_input_channel_parameter()
         resp[0] = '0'
         self.enabled = False
         return self._set_input_channel_parameter(resp)
@@ -804,7 +1747,7 @@ class Channel:
         """
         assert dwell in range(1, 201), "Dwell must be 1 to 200 sec"
 
-        resp = self.get_input_channel_parameter()
+        resp = self._cached_input_channel_parameter()
         resp[1] = str(dwell)  # seconds
         self.dwell = dwell  # seconds
         return self._set_input_channel_parameter(resp)
@@ -830,7 +1773,7 @@ class Channel:
         """
         assert pause in range(3, 201), "Pause must be 3 to 200 sec"
 
-        resp = self.get_input_channel_parameter()
+        resp = self._cached_input_channel_parameter()
         resp[2] = str(pause)  # seconds
         self.pause = pause  # seconds
         return self._set_input_channel_parameter(resp)
@@ -855,10 +1798,12 @@ class Channel:
         """
         assert curve_number in range(0, 60), "Curve number must from 0 to 59"
 
-        resp = self.get_input_channel_parameter()
+        resp = self._cached_input_channel_parameter()
         resp[3] = str(curve_number)
-        self.curve_num = self.get_calibration_curve()
-        return self._set_input_channel_parameter(resp)
+        resp = self._set_input_channel_parameter(resp)
+        # The 372 may not have taken the curve number, check next time
+        self.ls.invalidate_cache(f"INSET? {self.channel_num}")
+        return resp
 
     def get_calibration_curve(self):
         """Get calibration curve number using INSET?
@@ -883,7 +1828,7 @@ class Channel:
         """
         assert coefficient in ['positive', 'negative']
 
-        resp = self.get_input_channel_parameter()
+        resp = self._cached_input_channel_parameter()
         resp[4] = tempco_lock[coefficient]
         self.tempco = coefficient
         return self._set_input_channel_parameter(resp)
@@ -903,7 +1848,11 @@ class Channel:
         :returns: response from INNAME? command
         :rtype: str
         """
-        resp = self.ls.msg(f"INNAME? {self.channel_num}").strip()
+        return self._parse_sensor_input_name(
+            self.ls._config_query(f"INNAME? {self.channel_num}"))
+
+    def _parse_sensor_input_name(self, resp):
+        resp = resp.strip()
 
         self.name = resp
 
@@ -944,7 +1893,10 @@ class Channel:
         :returns: list of errors on reading (or None if no errors)
         :rtype: list of str
         """
-        resp = self.ls.msg(f"RDGST? {self.channel_num}")
+        return self._decode_reading_status(self.ls.msg(f"RDGST? {self.channel_num}"))
+
+    @staticmethod
+    def _decode_reading_status(resp):
         error_sum = int(resp)
 
         errors = {128: "T.UNDER",
@@ -1000,8 +1952,11 @@ class Channel:
         :returns: temperature limit in Kelvin
         :rtype: float
         """
-        resp = self.ls.msg(f"TLIMIT? {self.channel_num}").strip()
-        self.tlimit = float(resp)
+        return self._parse_temperature_limit(
+            self.ls._config_query(f"TLIMIT? {self.channel_num}"))
+
+    def _parse_temperature_limit(self, resp):
+        self.tlimit = float(resp.strip())
         return self.tlimit
 
     def __str__(self):
@@ -1034,6 +1989,7 @@ class Curve:
         self.format = None
         self.limit = None
         self.coefficient = None
+        self.breakpoints = None
         self.get_header()  # populates above values
 
     def get_header(self):
@@ -1232,6 +2188,35 @@ class Curve:
         _temp = float(resp[1])
         return (_units, _temp)
 
+    def get_data_points(self, indices):
+        """Get several data points using compound CRVPT? queries.
+
+        :param indices: indices of breakpoints to query
+        :type indices: list of int
+
+        :returns: units and temperature values for the given breakpoints
+        :rtype: 2 numpy arrays
+        """
+        resp = self.ls.query_many([f"CRVPT? {self.curve_num},{i}" for i in indices])
+        values = np.array([r.split(',')[:2] for r in resp], dtype=float).reshape(-1, 2)
+        return values[:, 0], values[:, 1]
+
+    def _set_data_points(self, indices, units, kelvin):
+        """Set several data points, packing CRVPT commands into as few lines
+        as possible.
+
+        :param indices: data point indices
+        :type indices: array of int
+        :param units: values of the sensor units to 6 digits
+        :type units: array of float
+        :param kelvin: values of the corresponding temps in Kelvin to 6 digits
+        :type kelvin: array of float
+        """
+        commands = [[f"CRVPT {self.curve_num},{i},{u:g},{k:g}"]
+                    for i, u, k in zip(indices, units, kelvin)]
+        for line in self.ls._pack_lines(commands):
+            self.ls.msg(';'.join(line))
+
     def _set_data_point(self, index, units, kelvin, curvature=None):
         """Set a single data point with the CRVPT command.
 
@@ -1259,16 +2244,26 @@ class Curve:
         """Get a calibration curve from the LS372.
 
         If _file is not None, save to file location.
+
+        Breakpoints are read with compound CRVPT? queries, 20 at a time,
+        stopping at the first empty (zero) breakpoint.
         """
-        breakpoints = []
-        for i in range(1, 201):
-            x = self.get_data_point(i)
-            if x[0] == 0:
+        units = []
+        temps = []
+        for start in range(1, 201, 20):
+            u, t = self.get_data_points(range(start, min(start + 20, 201)))
+            units.append(u)
+            temps.append(t)
+            if np.any(u == 0):
                 break
-            breakpoints.append(x)
 
-        struct_array = np.array(breakpoints, dtype=[('units', 'f8'),
-                                                    ('temperature', 'f8')])
+        units = np.concatenate(units)
+        temps = np.concatenate(temps)
+        n = np.argmax(units == 0) if np.any(units == 0) else len(units)
+
+        struct_array = np.zeros(n, dtype=[('units', 'f8'), ('temperature', 'f8')])
+        struct_array['units'] = units[:n]
+        struct_array['temperature'] = temps[:n]
 
         self.breakpoints = struct_array
 
@@ -1288,73 +2283,100 @@ class Curve:
 
         return self.breakpoints
 
-    def set_curve(self, _file):
+    def convert(self, resistance, method='curve'):
+        """Convert resistances to temperatures with this curve, offline.
+
+        Uses the breakpoints from the last get_curve() call, fetching them if
+        there are none yet. See resistance_to_temperature() for the methods.
+
+        :param resistance: resistances in Ohms
+        :type resistance: float or array
+
+        :returns: temperatures in Kelvin, NaN outside the curve
+        :rtype: float or array
+        """
+        if getattr(self, 'breakpoints', None) is None:
+            self.get_curve()
+        return resistance_to_temperature(resistance, self.breakpoints, self.format, method)
+
+    def set_curve(self, _file, cache_file=None, force=False):
         """Set a calibration curve, loading it from the file.
 
+        Breakpoints are uploaded several per command line, then read back with
+        compound queries and checked all at once.
+
+        If cache_file is given, a hash of the uploaded curve is stored there,
+        and uploading the same curve to the same curve number again is
+        skipped entirely (unless force is True).
+
         :param _file: the file to load the calibration curve from
         :type _file: str
+        :param cache_file: json file of content hashes of uploaded curves
+        :type cache_file: str
+        :param force: upload even if the cache says the curve is unchanged
+        :type force: bool
 
-        :returns: return the new curve header, refreshing the attributes
-        :rtype: list of str
+        :returns: whether the curve was uploaded
+        :rtype: bool
         """
-        with open(_file) as f:
-            content = f.readlines()
+        header, breakpoints = read_curve_file(_file)
 
-        header = []
-        for i in range(0, 6):
-            if i < 2 or i > 4:
-                header.append(content[i].strip().split(":", 1)[1].strip())
-            else:
-                header.append(content[i].strip().split(":", 1)[1].strip().split("(", 1)[0].strip())
+        digest = hashlib.sha256(repr(header).encode() + breakpoints.tobytes()).hexdigest()
+        key = f"{self.ls.id} curve {self.curve_num}"
+
+        cache = {}
+        if cache_file is not None and os.path.isfile(cache_file):
+            with open(cache_file) as f:
+                cache = json.load(f)
 
-        # Skip to the R and T values in the file and strip them of tabs, newlines, etc
-        values = []
-        for i in range(9, len(content)):
-            values.append(content[i].strip().split())
+        if not force and cache.get(key) == digest:
+            return False
 
         self.delete_curve()  # remove old curve first, so old breakpoints don't remain
 
-        self._set_header(header[:-1])  # ignore num of breakpoints
+        self._set_header(header)
 
-        for point in values:
-            print("uploading %s"%point)
-            self._set_data_point(point[0], point[1], point[2])
+        self._set_data_points(breakpoints['index'], breakpoints['units'],
+                              breakpoints['temperature'])
 
         # refresh curve attributes
         self.get_header()
-        self._check_curve(_file)
+        self._check_curve(breakpoints)
 
-    def _check_curve(self, _file):
-        """After setting a data point for calibration curve,
-        use CRVPT? command from get_data_point() to check
-        that all points of calibration curve  were uploaded.
-        If not, re-upload points.
+        if cache_file is not None:
+            cache[key] = digest
+            with open(cache_file, 'w') as f:
+                json.dump(cache, f, indent=1)
 
-        :param _file: calibration curve file
-        :type _file: str
+        return True
+
+    def _check_curve(self, breakpoints, retries=3):
+        """After uploading a calibration curve, read all of its breakpoints
+        back and check they match. Re-upload only the points that don't.
+
+        :param breakpoints: breakpoints that should have been uploaded
+        :type breakpoints: numpy structured array
+        :param retries: number of times to re-upload mismatched points
+        :type retries: int
         """
+        bad = np.ones(len(breakpoints), dtype=bool)
+        for attempt in range(retries + 1):
+            points = breakpoints[bad]
+            units, temps = self.get_data_points(points['index'])
 
-        with open(_file) as f:
-            content = f.readlines()
+            # The 372 stores 6 significant digits
+            ok = (np.isclose(units, points['units'], rtol=1e-5, atol=0)
+                  & np.isclose(temps, points['temperature'], rtol=1e-5, atol=0))
+            bad[bad] = ~ok
 
-        #skipping header info
-        values = []
-        for i in range(9, len(content)):
-            values.append(content[i].strip().split()) #data points that should have been uploaded
-    
-        for j in range(1, len(values)+1):
-            try:
-                resp = self.get_data_point(j) #response from the 372
-                point = values[j-1]
-                units = float(resp[0])
-                temperature = float(resp[1])
-                assert units == float(point[1]), "Point number %s not uploaded"%point[0]
-                assert temperature == float(point[2]), "Point number %s not uploaded"%point[0]
-                print("Successfully uploaded %s, %s" %(units,temperature))
-            #if AssertionError, tell 372 to re-upload points
-            except AssertionError:
-                if units != float(point[1]):
-                    self.set_curve(_file)
+            if not np.any(bad):
+                return
+
+            if attempt < retries:
+                missing = breakpoints[bad]
+                self._set_data_points(missing['index'], missing['units'], missing['temperature'])
+
+        raise RuntimeError("Breakpoints %s not uploaded" % list(breakpoints[bad]['index']))
 
     def delete_curve(self):
         """Delete the curve using the CRVDEL command.
@@ -1364,6 +2386,8 @@ class Curve:
         """
         resp = self.ls.msg(f"CRVDEL {self.curve_num}")
         self.get_header()
+        # Channels using this curve fall back to curve 0
+        self.ls.invalidate_cache('INSET?')
         return resp
 
     def __str__(self):
@@ -1386,26 +2410,34 @@ class Heater:
     :param output: the heater output we want to control, 0 = sample,
                    1 = warm-up, 2 = still
     :type output: int
+
+    Settings are fetched from the LS372 the first time they're accessed.
     """
+    # OUTMODE?
+    mode = LazyAttribute('get_output_mode')
+    input = LazyAttribute('get_output_mode')
+    powerup = LazyAttribute('get_output_mode')
+    polarity = LazyAttribute('get_output_mode')
+    filter = LazyAttribute('get_output_mode')
+    delay = LazyAttribute('get_output_mode')
+    # RANGE?
+    range = LazyAttribute('get_heater_range')
+    # HTRSET?
+    resistance = LazyAttribute('get_heater_setup')
+    max_current = LazyAttribute('get_heater_setup')
+    max_user_current = LazyAttribute('get_heater_setup')
+    display = LazyAttribute('get_heater_setup')
+
     def __init__(self, ls, output):
         self.ls = ls
         self.output = output
-        self.mode = None
-        self.input = None
-        self.powerup = None
-        self.polarity = None
-        self.filter = None
-        self.delay = None
 
-        self.range = None
-
-        self.resistance = None
-        self.max_current = None
-        self.max_user_current = None
-        self.display = None
-
-        self.get_output_mode()
-        self.get_heater_setup()
+    def _config_queries(self):
+        """Configuration queries for this output, with their reply parsers and
+        the refresh methods of the lazy attributes they set."""
+        return {f"OUTMODE? {self.output}": (self._parse_output_mode, 'get_output_mode'),
+                f"RANGE? {self.output}": (self._parse_heater_range, 'get_heater_range'),
+                f"HTRSET? {self.output}": (self._parse_heater_setup, 'get_heater_setup')}
 
     def get_output_mode(self):
         """Query the heater mode using the OUTMODE? command.
@@ -1415,7 +2447,11 @@ class Heater:
                   delay time.
         :rtype: tuple
         """
-        resp = self.ls.msg(f"OUTMODE? {self.output}").split(",")
+        return self._parse_output_mode(
+            self.ls._config_query(f"OUTMODE? {self.output}"))
+
+    def _parse_output_mode(self, resp):
+        resp = resp.split(",")
 
         # TODO: make these human readable
         self.mode = output_modes[resp[0]]
@@ -1444,11 +2480,12 @@ class Heater:
         """
         assert len(params) == 6
 
-        reply = [str(self.output)]
-        [reply.append(x) for x in params]
+        return self.ls._write_config(f"OUTMODE {self.output}", f"OUTMODE? {self.output}",
+                                     params, self._parse_output_mode)
 
-        param_str = ','.join(reply)
-        return self.ls.msg(f"OUTMODE {param_str}")
+    def _cached_output_mode(self):
+        """OUTMODE parameters from the state cache, only queried if unknown."""
+        return self.ls._cached_params(f"OUTMODE? {self.output}", self.get_output_mode)
 
     def _set_heater_setup(self, params):
         """
@@ -1470,11 +2507,12 @@ class Heater:
 
         assert len(params) == 4
 
-        reply = [str(self.output)]
-        [reply.append(x) for x in params]
+        return self.ls._write_config(f"HTRSET {self.output}", f"HTRSET? {self.output}",
+                                     params, self._parse_heater_setup)
 
-        param_str = ','.join(reply)
-        return self.ls.msg("HTRSET {}".format(param_str))
+    def _cached_heater_setup(self):
+        """HTRSET parameters from the state cache, only queried if unknown."""
+        return self.ls._cached_params(f"HTRSET? {self.output}", self.get_heater_setup)
 
     def get_mode(self):
         """Set output mode with OUTMODE? commnd.
@@ -1497,7 +2535,7 @@ class Heater:
         # TODO: Make assertions check specific output and it's validity in mode selection
         assert mode.lower() in output_modes_lock.keys(), f"{mode} not a valid mode"
 
-        resp = self.get_output_mode()
+        resp = self._cached_output_mode()
         resp[0] = output_modes_lock[mode.lower()]
         self.mode = mode
         return self._set_output_mode(resp)
@@ -1524,7 +2562,7 @@ class Heater:
         """
         assert int(_input) in range(17) or _input == "A", f"{_input} not a valid input/channel"
 
-        resp = self.get_output_mode()
+        resp = self._cached_output_mode()
         resp[1] = str(_input)
         self.input = str(_input)
         return self._set_output_mode(resp)
@@ -1597,13 +2635,11 @@ class Heater:
 
         assert display.lower() in heater_display_lock.keys(), f"{display} is not a valid display"
 
-        resp = self.get_heater_setup()
+        resp = self._cached_heater_setup()
         resp[3] = heater_display_lock[display.lower()]
 
         self._set_heater_setup(resp)
 
-        self.get_heater_setup()
-
     # Presumably we're going to know and have set values for heat resistance,
     # max current, etc, maybe that'll simplify this in the future.
     def set_heater_output(self, output, display_type=None):
@@ -1626,7 +2662,6 @@ class Heater:
             self.set_heater_display(display_type)
 
         self.get_heater_range()
-        self.get_heater_setup()
 
         if self.range in ["off", "Off"]:
             print("Heater range is off... Not setting output")
@@ -1684,7 +2719,11 @@ class Heater:
 
         :return resp: List of values that have been returned from the Lakeshore.
         """
-        resp = self.ls.msg("HTRSET? {}".format(self.output)).split(',')
+        return self._parse_heater_setup(
+            self.ls._config_query("HTRSET? {}".format(self.output)))
+
+    def _parse_heater_setup(self, resp):
+        resp = resp.split(',')
 
         self.resistance = float(resp[0])
         self.max_current = int(resp[1])
@@ -1695,21 +2734,53 @@ class Heater:
 
 
     # RAMP, RAMP? - in heater class
+    def _get_ramp(self):
+        """Query ramp settings with the RAMP? command.
+
+        :returns: whether ramping is enabled, ramp rate in K/min
+        :rtype: bool, float
+        """
+        resp = self.ls.msg(f"RAMP? {self.output}").split(',')
+        return bool(int(resp[0])), float(resp[1])
+
     def set_ramp_rate(self, rate):
-        pass
+        """Set the setpoint ramp rate with the RAMP command, leaving ramping
+        enabled or disabled as it was.
 
-    def get_ramp_rate(self, rate):
-        pass
+        :param rate: ramp rate in K/min, 0.001 to 100
+        :type rate: float
+        """
+        assert 0.001 <= rate <= 100, "Ramp rate must be 0.001 to 100 K/min"
+
+        enabled, _ = self._get_ramp()
+        self.ls.msg(f"RAMP {self.output},{int(enabled)},{rate}")
+
+    def get_ramp_rate(self):
+        """Get the setpoint ramp rate with the RAMP? command.
+
+        :returns: ramp rate in K/min
+        :rtype: float
+        """
+        return self._get_ramp()[1]
 
     def enable_ramp(self):
-        pass
+        """Ramp the setpoint to new values at the ramp rate."""
+        _, rate = self._get_ramp()
+        self.ls.msg(f"RAMP {self.output},1,{rate}")
 
     def disable_ramp(self):
-        pass
+        """Change the setpoint immediately to new values."""
+        _, rate = self._get_ramp()
+        self.ls.msg(f"RAMP {self.output},0,{rate}")
 
     # RAMPST?
     def get_ramp_status(self):
-        pass
+        """Query whether the setpoint is ramping with the RAMPST? command.
+
+        :returns: True while the setpoint is ramping
+        :rtype: bool
+        """
+        return bool(int(self.ls.msg(f"RAMPST? {self.output}")))
 
     # RANGE
     def set_heater_range(self, _range):
@@ -1730,14 +2801,17 @@ class Heater:
             _range = "On"
 
         if self.output == 0:
-            resp = self.ls.msg(f"RANGE {self.output} {heater_range_lock[_range]}").strip()
+            code = heater_range_lock[_range]
         else:
             on_off_key = {"0": "Off", "1": "On"}
             on_off_lock = {v:k for k, v in on_off_key.items()}
-            resp = self.ls.msg(f"RANGE {self.output} {on_off_lock[_range]}").strip()
+            code = on_off_lock[_range]
 
-        # refresh self.heater value with RANGE? query
-        self.get_heater_range()
+        # Always sent: the 372 turns the heater off by itself (faults, TLIMIT,
+        # front panel), so the cached range can't be trusted to skip it
+        with self.ls.lock:
+            self.ls.msg(f"RANGE {self.output},{code}")
+            return self.get_heater_range()
 
     def get_heater_range(self):
         """Get heater range with RANGE? command.
@@ -1745,7 +2819,10 @@ class Heater:
         :returns: heater range in amps
         :rtype: float
         """
-        resp = self.ls.msg(f"RANGE? {self.output}").strip()
+        return self._parse_heater_range(self.ls._config_query(f"RANGE? {self.output}"))
+
+    def _parse_heater_range(self, resp):
+        resp = resp.strip()
 
         if self.output == 0:
             self.range = heater_range_key[resp]
@@ -16,24 +16,63 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
-from slab.instruments import SocketInstrument
-import visa
+import asyncio
 import logging
+import os
+import sys
+import threading
 import types
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from numpy import pi
 import numpy as np
 from time import *
 
-class ZNB20(SocketInstrument):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SCPI'))
+
+from SCPITransport import SCPITransport
+
+class ZNB20(SCPITransport):
 
     MAXSWEEPPTS = 1601
+    # Most points a ZNB sweep can have, used for CW time traces
+    MAXCWPTS = 100001
     default_port = 5025
 
-    def __init__(self, name="BatMouse", address=None, enabled=True, **kwargs):
-        SocketInstrument.__init__(self, name, address, enabled=enabled, recv_length=2 ** 20, **kwargs)
-        self.query_sleep = 0.05
-        self.timeout = 100
-        self.read_termination = '\n'
+    # Settings that change when another one is set, by their _key
+    coupled_settings = {'freq:cent': ('freq:star', 'freq:stop'),
+                        'freq:span': ('freq:star', 'freq:stop'),
+                        'freq:star': ('freq:cent', 'freq:span'),
+                        'freq:stop': ('freq:cent', 'freq:span')}
+
+    # Segments defined or read back per command
+    segments_per_command = 32
+
+    # FORM:DATA argument for each transfer format
+    transfer_formats = {'ascii': 'ASC,0', 'real32': 'REAL,32', 'real64': 'REAL,64'}
+    # Complex dtype of a binary block, FORM:BORD SWAP is little endian
+    transfer_dtypes = {'real32': '<c8', 'real64': '<c16'}
+    # Dtype of a block of real values, e.g. the stimulus
+    stimulus_dtypes = {'real32': '<f4', 'real64': '<f8'}
+
+    def __init__(self, name="BatMouse", address=None, enabled=True, transfer_format='real64', **kwargs):
+        # Replies are read up to the terminator, no need to sleep
+        kwargs.setdefault('timeout', 100)
+        # The connection is only opened by the first command, never if not
+        # enabled
+        SCPITransport.__init__(self, address, port=self.default_port, enabled=enabled, **kwargs)
+        self.name = name
+
+        self.transfer_format = 'ascii'
+        self._sweep_executor = None
+        # Reused by _get_data to receive traces when given an output buffer
+        self._receive_buffer = bytearray()
+        # Last value written for each setting, and settings waiting to be
+        # written by configure()
+        self._state = {}
+        self._pending = None
+        if enabled and address is not None:
+            self.set_transfer_format(transfer_format)
 
 
 # ###################################################################
@@ -54,7 +93,188 @@ class ZNB20(SocketInstrument):
         '''
         logging.info(__name__ + ' : Resetting instrument')
         self.write('*RST')
+        self.invalidate_cache()
+
+
+    def invalidate_cache(self):
+        '''
+        Forget the settings written so far, so configure() sends them all
+        again. Needed if they were changed on the front panel.
+
+        Input:
+            None
+
+        Output:
+            None
+        '''
+        self._state.clear()
+
+    @staticmethod
+    def _key(header):
+        '''
+        Cache key of a setting, the same for every way of writing its
+        header: 'SENSe1:FREQuency:STARt', 'sens:freq:star' and
+        'frequency:start' all give 'freq:star'. Nodes are lower case in
+        their short form, suffix 1 and the optional SENSe root are left
+        out.
+        '''
+        nodes = []
+        for node in header.strip().lstrip(':').lower().split(':'):
+            mnemonic = node.rstrip('0123456789')
+            suffix = node[len(mnemonic):]
+            if len(mnemonic) > 4:
+                # SCPI short form: four letters, three if the fourth is a vowel
+                mnemonic = mnemonic[:3] if mnemonic[3] in 'aeiou' else mnemonic[:4]
+            nodes.append(mnemonic + ('' if suffix == '1' else suffix))
+        if len(nodes) > 1 and nodes[0] == 'sens':
+            nodes = nodes[1:]
+        return ':'.join(nodes)
+
+    def _forget_coupled(self, key, keep = ()):
+        '''
+        Drop the cached settings that change along with the one at key,
+        except those in keep.
+        '''
+        root, rest = '', key
+        if key.startswith('sens'):
+            # Channel other than 1, e.g. 'sens2:freq:star'
+            root, _, rest = key.partition(':')
+            root += ':'
+        for coupled in self.coupled_settings.get(rest, ()):
+            if root + coupled not in keep:
+                self._state.pop(root + coupled, None)
+
+    def _set(self, header, value, expected = None):
+        '''
+        Write a setting, or hold it back until the end of the configure()
+        block we're in.
+
+        Input:
+            header (string): SCPI command, e.g. 'sens:band'
+            value: its parameter
+            expected: what the "header?" query should return, if not value
+
+        Output:
+            None
+        '''
+        value = str(value)
+        key = self._key(header)
+        if self._pending is not None:
+            for other in [other for other in self._pending if self._key(other) == key]:
+                del self._pending[other]
+            self._pending[header] = (value, expected)
+            return
+
+        self.write('%s %s' % (header, value))
+        self._state[key] = value
+        self._forget_coupled(key)
+
+    @staticmethod
+    def _same(expected, actual):
+        '''
+        Compare a setting to what the instrument reports for it.
+        '''
+        on_off = {'ON': '1', 'OFF': '0'}
+        expected = str(expected).strip().strip('\'"').upper()
+        actual = actual.strip().strip('\'"').upper()
+        expected = on_off.get(expected, expected)
+        actual = on_off.get(actual, actual)
+        try:
+            return np.isclose(float(expected), float(actual), rtol = 1e-9, atol = 0)
+        except ValueError:
+            return expected == actual
+
+    def _verify(self, settings):
+        '''
+        Read back settings with a single compound query.
+
+        Input:
+            settings (dict): header: (value, expected)
 
+        Output:
+            mismatched (dict): header: value reported by the instrument, for
+                               each setting that isn't as expected
+        '''
+        headers = list(settings)
+        actual = self.query(';:'.join('%s?' % header for header in headers)).strip().split(';')
+
+        mismatched = {}
+        for header, reported in zip(headers, actual):
+            value, expected = settings[header]
+            if not self._same(value if expected is None else expected, reported):
+                mismatched[header] = reported
+        return mismatched
+
+    @contextmanager
+    def configure(self, verify = True):
+        '''
+        Group settings into one write.
+
+        Setters called inside the block are held back. At the end of the
+        block, the settings that differ from what was last written are
+        sent together as one semicolon-joined line, then all of them are
+        read back with one compound query. Settings that were skipped but
+        turn out to have been changed on the instrument are sent again. If
+        the block raises, nothing is sent.
+
+            with znb.configure():
+                znb.set_startfrequency(4e9)
+                znb.set_stopfrequency(8e9)
+                znb.set_points(1601)
+                znb.set_measBW(100)
+
+        Input:
+            verify (bool): read the settings back at the end
+
+        Output:
+            None
+        '''
+        if self._pending is not None:
+            # Already in a configure block, the outer one writes everything
+            yield
+            return
+
+        self._pending = {}
+        try:
+            yield
+            pending = self._pending
+        finally:
+            self._pending = None
+
+        logging.info(__name__ + ' : configure %s' % ', '.join(pending))
+
+        changed = [header for header, (value, _) in pending.items() if self._state.get(self._key(header)) != value]
+        self._write_settings(pending, changed)
+        if not verify or not pending:
+            return
+
+        mismatched = self._verify(pending)
+
+        # Skipped settings that were changed behind our back, send them after all
+        stale = {header: pending[header] for header in mismatched if header not in changed}
+        if stale:
+            self._write_settings(stale, list(stale))
+            for header in stale:
+                del mismatched[header]
+            mismatched.update(self._verify(stale))
+
+        for header, reported in mismatched.items():
+            logging.warning(__name__ + ' : %s set to %s but the instrument reports %s'
+                            % (header, pending[header][0], reported))
+            # Send it again next time
+            self._state.pop(self._key(header), None)
+
+    def _write_settings(self, settings, headers):
+        '''
+        Write several settings as one semicolon-joined line.
+        '''
+        if not headers:
+            return
+        self.write(';:'.join('%s %s' % (header, settings[header][0]) for header in headers))
+        keys = [self._key(header) for header in headers]
+        for header, key in zip(headers, keys):
+            self._state[key] = settings[header][0]
+            self._forget_coupled(key, keys)
 
 #     def get_all(self):
 #         '''
@@ -153,9 +373,15 @@ class ZNB20(SocketInstrument):
 
 
 
-    def create_traces(self, traces, Sparams):
+    def create_traces(self, traces, Sparams, channel = 1):
         """
-            Create traces in the ZNB
+            Create traces in a channel of the ZNB, displayed in the window
+            with the channel's number. The channel is created if it doesn't
+            exist. Creating the traces of channel 1 deletes every trace
+            first, for other channels only those of the channel, so
+            channels 2, 3, ... can be added once channel 1 is set up.
+            Trace names must differ between channels.
+
             Input:
                 - traces (tuple): Name of the traces from which we get data.
                                   Should be a tuple of string.
@@ -167,6 +393,7 @@ class ZNB20(SocketInstrument):
                                    ('Sparams', 'Sparams', ...)
                                    If only one S parameter, write ('Sparam1',)
                                    to have a tuple.
+                - channel (int): channel to create the traces in
 
             Output:
                 - None
@@ -189,90 +416,213 @@ class ZNB20(SocketInstrument):
         if not all([type(Sparam) is str for Sparam in Sparams]):
             raise ValueError('Element in Sparams should be string type')
 
-        logging.info(__name__ + ' : create trace(s)')
+        logging.info(__name__ + ' : create trace(s) in channel %s' % channel)
 
         # First we erase memory
-        self.write('calc:parameter:del:all ')
+        if channel == 1:
+            self.write('calc:parameter:del:all ')
+        else:
+            self.write('calc%s:parameter:del:call' % channel)
 
         # For each traces we want, we create
         for trace, Sparam in zip(traces, Sparams):
-            self.write('calc:parameter:sdef  "%s","%s"'
-                                       % (trace, Sparam))
+            self.write('calc%s:parameter:sdef  "%s","%s"'
+                                       % (channel, trace, Sparam))
 
         # We display traces on the device
         # First we put display on
-        self.write('disp:wind1:stat on')
+        self.write('disp:wind%s:stat on' % channel)
 
         # Second we display all traces
         for i, trace in enumerate(traces):
-            self.write('disp:wind1:trac%s:feed "%s"'
-                                       % (i + 1, trace))
+            self.write('disp:wind%s:trac%s:feed "%s"'
+                                       % (channel, i + 1, trace))
 
         # We set the update od the display on
         self.write('syst:disp:upd on')
 
         # We set continuous measurement on off
         # The measurement will be stopped after the setted number of sweep
-        self.write('init:cont off')
+        self.write('init%s:cont off' % channel)
+
+
+
+###################################################################
+#
+#                           Data transfer
+#
+###################################################################
+
+    def set_transfer_format(self, transfer_format = 'real64'):
+        '''
+        Set the format trace data is sent in. Binary blocks are much quicker
+        to send and decode than ASCII, which is kept as a fallback.
+
+        Input:
+            transfer_format (string): 'real64', 'real32' or 'ascii'
+
+        Output:
+            None
+        '''
+        logging.info(__name__ + ' : Set the data transfer format to %s' % transfer_format)
+
+        if transfer_format.lower() not in self.transfer_formats:
+            raise ValueError("set_transfer_format(): can only set 'real64', 'real32' or 'ascii'")
+
+        self.write('FORM:DATA %s;:FORM:BORD SWAP' % self.transfer_formats[transfer_format.lower()])
+        self.transfer_format = transfer_format.lower()
+
+    def get_transfer_format(self):
+        '''
+        Get the format trace data is sent in
 
+        Input:
+            None
+
+        Output:
+            transfer_format (string): 'real64', 'real32' or 'ascii'
+        '''
+        logging.info(__name__ + ' : Get the data transfer format')
+
+        stat = self.query('FORM:DATA?').strip().upper()
+
+        if stat.startswith('ASC'):
+            return 'ascii'
+        elif stat in ('REAL,32', 'REAL,64'):
+            return 'real' + stat[-2:]
+        else:
+            raise ValueError('Transfer format not specified : %s' % stat)
+
+    def _query_complex(self, cmd, into = None):
+        '''
+        Query complex data, e.g. CALC:DATA? SDAT, in the current transfer
+        format.
+
+        Input:
+            cmd (string): query returning real, imag pairs
+            into (bytearray): buffer to receive a binary reply into, the
+                              returned array is then a view of it
+
+        Output:
+            data (complex array)
+        '''
+        if self.transfer_format == 'ascii':
+            # Interleaved real, imag pairs are a complex array already
+            return np.fromstring(self.query(cmd), sep = ',').view(np.complex128)
+
+        return np.frombuffer(self.query_block(cmd, into = into), dtype = self.transfer_dtypes[self.transfer_format])
+
+    @staticmethod
+    def convert_data(data, data_format = 'db-phase', out = None):
+        '''
+        Convert complex data to a pair of real arrays, computed in place in
+        out so that nothing is allocated when out is reused from sweep to
+        sweep.
+
+        data_format is '<magnitude>-<phase>' with magnitude one of
+            real: real part, the phase is then the imaginary part
+            db: 20*log10(|S|)
+            lin: |S|
+            amp: |S|**2
+        and phase one of
+            phase: phase in rad, between -pi and pi
+            unwrap: phase in rad, unwrapped along the sweep
 
+        Input:
+            data (complex array): e.g. from _query_complex
+            data_format (string): 'real-imag', 'db-phase', 'lin-phase',
+                                  'amp-phase', 'db-unwrap', ...
+            out (array): (2, len(data)) float64 array to write the result
+                         to, allocated if None
 
-    def _get_data(self, trace, data_format = 'db-phase'):
+        Output:
+            magnitude, phase (arrays): rows of out
+        '''
+        magnitude_format, _, phase_format = data_format.lower().partition('-')
+        if data_format.lower() != 'real-imag' and (magnitude_format not in ('db', 'lin', 'amp')
+                                                   or phase_format not in ('phase', 'unwrap')):
+            raise ValueError("data_format must be 'real-imag' or '<db|lin|amp>-<phase|unwrap>', not %r"
+                             % data_format)
+
+        if out is None:
+            out = np.empty((2, len(data)))
+        magnitude, phase = out
+
+        if magnitude_format == 'real':
+            np.copyto(magnitude, data.real)
+            np.copyto(phase, data.imag)
+            return magnitude, phase
+
+        np.arctan2(data.imag, data.real, out = phase)
+        if phase_format == 'unwrap' and len(data) > 1:
+            # Same as np.unwrap, using magnitude as scratch space: wrap the
+            # steps between points to [-pi, pi) and add them back up
+            step = magnitude[1:]
+            np.subtract(phase[1:], phase[:-1], out = step)
+            step += pi
+            np.mod(step, 2*pi, out = step)
+            step -= pi
+            np.cumsum(step, out = phase[1:])
+            phase[1:] += phase[0]
+
+        np.abs(data, out = magnitude)
+        if magnitude_format == 'amp':
+            np.square(magnitude, out = magnitude)
+        elif magnitude_format == 'db':
+            with np.errstate(divide = 'ignore'):
+                np.log10(magnitude, out = magnitude)
+            magnitude *= 20.
+        return magnitude, phase
+
+    def _get_data(self, trace, data_format = 'db-phase', out = None):
         """
             Return data given by the ZNB in the asked format.
             Input:
                 - trace (string): Name of the trace from which we get data
-                - data_format (string): must be:
-                                        'real-imag', 'db-phase', 'amp-phase'
+                - data_format (string): 'real-imag', 'db-phase',
+                                        'lin-phase', 'amp-phase', or with
+                                        'unwrap' for the phase unwrapped
+                                        along the sweep, see convert_data.
                                         The phase is returned in rad.
+                - out (array): (2, n_points) float64 array the result is
+                               written to. Pass the same one on every call
+                               to fetch repeated sweeps without allocating.
 
             Output:
                 - Following the data_format input it returns the tupples:
                     real, imag
                     db, phase
+                    lin, phase
                     amp, phase
         """
 
         # Selects an existing trace as the active trace of the channel
         self.write('calc:parameter:sel "%s"' % (trace))
 
-        # Get data as a string
-        # val = self.query('calculate:Data? Sdata')
-        
-        p = 0
-        val = []
-        while len(val)//2!=self.nb_points:
-            p+=1
-            val = self.query('CALC:DATA? SDAT')
-        # Transform the string in a numpy array
-        # np.fromstring is faster than np.array
-            val = np.fromstring(val, sep = ',')
-
-            if p>10: 
-                print('Cannot get data')
-                break
-
-
-
-        # Change the shape of the array to get the real an imaginary part
-        real, imag = np.transpose(np.reshape(val, (-1, 2)))
-
-        if data_format.lower() == 'real-imag':
-            return real, imag
-        elif data_format.lower() == 'db-phase':
-            try : 
-                return 20.*np.log10(abs(real + 1j*imag)), np.angle(real + 1j*imag)
-            except RuntimeError : 
-                print('Division by zero error - Phase')
-                return np.ones_like(real)
-        elif data_format.lower() == 'amp-phase':
-            try : 
-                return abs(real + 1j*imag)**2., np.angle(real + 1j*imag)
-            except RuntimeError : 
-                print('Division by zero error - Amplitude')
-                return np.ones_like(real)
+        if self.transfer_format == 'ascii':
+            p = 0
+            data = []
+            while len(data)!=self.nb_points:
+                p+=1
+                data = self._query_complex('CALC:DATA? SDAT')
+
+                if p>10: 
+                    print('Cannot get data')
+                    break
+        elif out is not None:
+            # A definite length block always arrives whole, no need to check
+            # the number of points. The result is copied to out, so the
+            # receive buffer can be reused too.
+            size = out.shape[-1]*np.dtype(self.transfer_dtypes[self.transfer_format]).itemsize
+            if len(self._receive_buffer) < size:
+                self._receive_buffer = bytearray(size)
+            data = self._query_complex('CALC:DATA? SDAT', into = self._receive_buffer)
         else:
-            raise ValueError("data-format must be: 'real-imag', 'db-phase', 'amp-phase'.")
+            data = self._query_complex('CALC:DATA? SDAT')
+
+        if data_format.lower() == 'real-imag' and out is None:
+            return data.real, data.imag
+        return self.convert_data(data, data_format, out)
 
 
     def get_traces(self, traces, data_format = 'db-phase'):
@@ -306,25 +656,80 @@ class ZNB20(SocketInstrument):
 
         logging.info(__name__ +\
                      ' : start to measure and wait till it is finished')
-        # print(self.get_points(), self.get_measBW(), self.get_averages())
-        # sleep(int(self.get_points())/int(self.get_measBW())*int(self.get_averages()))
 
-        data = []
-        while True:
+        self.wait_for_sweep()
+
+        temp = []
+        for trace in traces:
+
+            temp.append(self._get_data(trace, data_format = data_format))
+
+        return temp
+
+
+    def get_all_traces(self, channel = 1):
+        """
+            Fetch the stimulus and the data of every trace in a channel in a
+            single round trip, with one compound query for the trace
+            catalog, CALC:DATA:STIM? and CALC:DATA:CALL? SDAT.
+
+            Input:
+                - channel (int): channel number
+
+            Output:
+                - stimulus (array): frequencies [Hz] or powers [dBm] of the
+                                    sweep points
+                - sparams (list): S parameter of each trace, in the order
+                                  they're stacked in data
+                - data (complex array): (n_traces, n_points) complex data
+        """
+
+        logging.info(__name__ + ' : get all traces of channel %s' % channel)
 
-            if self.query('*ESR?')[:-1] != '1':
-                continue
-            else:
-                freqs = np.fromstring(self.query('CALC:DATA:STIM?'), sep = ',') 
-                Sp = np.fromstring(self.query('CALC:DATA? SDAT'), sep = ',') 
-                temp = []
-                # data = []
-                for trace in traces:
+        return self.get_channels_traces([channel])[channel]
+
+    def get_channels_traces(self, channels = None):
+        """
+            Fetch the stimulus and the data of every trace of several
+            channels in a single round trip, see get_all_traces.
 
-                    temp.append(self._get_data(trace, data_format = data_format))
+            Input:
+                - channels (list): channel numbers, all channels if None
+
+            Output:
+                - traces (dict): channel -> (stimulus, sparams, data) as
+                                 returned by get_all_traces
+        """
 
+        if channels is None:
+            channels = self.get_channels()
 
-            return temp
+        logging.info(__name__ + ' : get all traces of channels %s' % (channels,))
+
+        def read():
+            if self.transfer_format == 'ascii':
+                replies = self.read_line().split(';')
+                for i in range(len(channels)):
+                    catalog, stimulus, val = replies[3*i:3*i + 3]
+                    yield catalog, np.fromstring(stimulus, sep = ','), \
+                        np.fromstring(val, sep = ',').view(np.complex128)
+                return
+
+            for channel in channels:
+                catalog = self.read_text()
+                stimulus = np.frombuffer(self.read_block(), dtype = self.stimulus_dtypes[self.transfer_format])
+                data = np.frombuffer(self.read_block(), dtype = self.transfer_dtypes[self.transfer_format])
+                yield catalog, stimulus, data
+
+        replies = self._query(';:'.join('CALC%d:DATA:CALL:CAT?;:CALC%d:DATA:STIM?;:CALC%d:DATA:CALL? SDAT'
+                                        % (channel, channel, channel) for channel in channels),
+                              lambda: list(read()), None)
+
+        traces = {}
+        for channel, (catalog, stimulus, data) in zip(channels, replies):
+            sparams = catalog.strip().strip("'").split(',')
+            traces[channel] = (stimulus, sparams, data.reshape(len(sparams), -1))
+        return traces
 
 
     def measure(self):
@@ -344,6 +749,171 @@ class ZNB20(SocketInstrument):
         self.write('*CLS')
         self.write('INITiate1:IMMediate; *OPC')
 
+###################################################################
+#
+#                           Sweep completion
+#
+###################################################################
+
+    def get_sweep_time(self, channel = 1):
+        '''
+        Estimate how long a measurement takes, points/measBW per sweep, or
+        the instrument's own sweep time if longer (dwell times, segments),
+        times the number of sweeps INIT runs (sens:sweep:count) and the
+        number of averages when averaging is on.
+
+        Input:
+            channel (int or 'all'): channel, or 'all' for the total of all
+                                    channels, which are swept one after
+                                    the other
+
+        Output:
+            time (float): expected measurement time [s]
+        '''
+        logging.info(__name__ + ' : Get the expected sweep time')
+
+        queries = ('sens%d:sweep:points?', 'sens%d:band?', 'sens%d:sweep:time?', 'sens%d:sweep:count?',
+                   'sens%d:average?', 'sens%d:average:count?')
+        channels = self.get_channels() if channel == 'all' else [channel]
+        replies = self.query(';:'.join(query % channel for channel in channels for query in queries)).split(';')
+
+        total = 0.
+        for i in range(len(channels)):
+            points, BW, sweeptime, sweeps, average, averages = replies[len(queries)*i:len(queries)*(i + 1)]
+            sweep = max(float(points)/float(BW), float(sweeptime)) * max(int(float(sweeps)), 1)
+            if average.strip().upper() in ('1', 'ON'):
+                sweep *= max(int(float(averages)), 1)
+            total += sweep
+        return total
+
+    def wait_for_sweep(self, timeout = None, min_interval = 0.01, max_interval = 1.):
+        '''
+        Wait for the measurement started by measure() to finish.
+
+        Bit 0 of *ESR? (operation complete, set by the *OPC in measure) is
+        polled, first after the expected sweep time, then at intervals
+        doubling from min_interval to max_interval, instead of querying as
+        fast as the socket allows.
+
+        Input:
+            timeout (float): give up after this long [s], defaults to twice
+                             the expected sweep time plus 10 s
+            min_interval (float): first polling interval [s]
+            max_interval (float): longest polling interval [s]
+
+        Output:
+            None
+        '''
+        logging.info(__name__ + ' : wait for the sweep to finish')
+
+        expected = self.get_sweep_time()
+        if timeout is None:
+            timeout = 2*expected + 10
+        start = monotonic()
+
+        sleep(min(expected, timeout))
+        interval = min_interval
+        while not int(self.query('*ESR?')) & 1:
+            if monotonic() - start > timeout:
+                raise IOError('Sweep did not finish within %s s' % timeout)
+            sleep(interval)
+            interval = min(2*interval, max_interval)
+
+    def _wait_opc(self, commands, timeout, started):
+        '''
+        Start the sweep and block on *OPC? until it's done, holding the
+        connection so nothing else is sent or read meanwhile.
+        '''
+        with self.lock:
+            started.set()
+            for cmd in commands:
+                self.write(cmd)
+            return self.read_line(timeout).strip() == '1'
+
+    def start_sweep(self, timeout = None, channel = 1):
+        '''
+        Start a single measurement and return straight away.
+
+        The sweep is started together with *OPC?, which the instrument
+        only answers once the sweep is done, so nothing is sent while
+        waiting. The wait happens in a background thread: the returned
+        future is done once the sweep is, and the script can get on with
+        other work (processing or saving the previous sweep) meanwhile.
+        The background thread holds self.lock until the sweep is done, so
+        anything sent to the instrument in the meantime, from this thread
+        or another one, waits for the sweep instead of taking its reply.
+        Don't call it while holding self.lock yourself.
+
+            sweep = znb.start_sweep()
+            save(previous_data)
+            sweep.result()
+            data = znb.get_all_traces()
+
+        With channel='all' every channel is swept, one after the other,
+        from a single INIT:ALL, and the future is done once the last one
+        is; get_channels_traces then fetches them all at once.
+
+        Input:
+            timeout (float): give up after this long [s], defaults to twice
+                             the expected sweep time plus 10 s
+            channel (int or 'all'): channel to sweep, or 'all'
+
+        Output:
+            future (concurrent.futures.Future): result is True when the
+                                                sweep finished
+        '''
+        logging.info(__name__ + ' : start a sweep of channel %s' % channel)
+
+        # Generous, so a slow sweep isn't mistaken for a lost one
+        if timeout is None:
+            timeout = 2*self.get_sweep_time(channel) + 10
+
+        if channel == 'all':
+            commands = ['*CLS', 'INITiate:CONTinuous:ALL OFF', 'INITiate:IMMediate:ALL;*OPC?']
+        else:
+            commands = ['*CLS', 'initiate%d:cont off' % channel, 'INITiate%d:IMMediate;*OPC?' % channel]
+
+        if self._sweep_executor is None:
+            self._sweep_executor = ThreadPoolExecutor(max_workers = 1)
+        # Only return once the background thread has the connection, so the
+        # next command can't get in before the sweep is started
+        started = threading.Event()
+        sweep = self._sweep_executor.submit(self._wait_opc, commands, timeout, started)
+        started.wait()
+        return sweep
+
+    def sweep(self, timeout = None, channel = 1):
+        '''
+        Make a single measurement and wait for it to finish, see
+        start_sweep.
+
+        Input:
+            timeout (float): give up after this long [s]
+            channel (int or 'all'): channel to sweep, or 'all'
+
+        Output:
+            None
+        '''
+        self.start_sweep(timeout, channel).result()
+
+    async def sweep_async(self, timeout = None, channel = 1):
+        '''
+        Make a single measurement, awaitable from asyncio code, see
+        start_sweep.
+
+        Input:
+            timeout (float): give up after this long [s]
+            channel (int or 'all'): channel to sweep, or 'all'
+
+        Output:
+            None
+        '''
+        # start_sweep queries the sweep time and waits for the connection,
+        # keep that off the event loop too
+        loop = asyncio.get_running_loop()
+        sweep = await loop.run_in_executor(None, self.start_sweep, timeout, channel)
+        await asyncio.wrap_future(sweep)
+
 
     def averageclear(self):
         '''
@@ -375,7 +945,7 @@ class ZNB20(SocketInstrument):
         ' : The source of the trigger is set to %s' % trigger)
 
         if trigger.upper() in ('IMM', 'EXT', 'MAN', 'MULT'):
-            self.write("TRIG:SOUR "+str(trigger.upper()))
+            self._set('TRIG:SOUR', trigger.upper())
 
         else:
             raise ValueError('set_trigger(): can only set IMM, EXT, MAN or MULT')
@@ -417,7 +987,7 @@ class ZNB20(SocketInstrument):
                       ' : The type of the sweep is set to %s' % sweeptype)
 
         if sweeptype.upper() in ('LIN', 'LOG', 'POW', 'CW', 'POIN', 'SEGM'):
-            self.write("SWE:TYPE "+str(sweeptype.upper()))
+            self._set('SWE:TYPE', sweeptype.upper())
         else:
             raise ValueError('set_sweeptype(): can only set LIN, LOG, POW, CW, POIN or SEGM')
 
@@ -515,6 +1085,94 @@ class ZNB20(SocketInstrument):
         else:
             print('set_time should be dweel or sweeptime')
 
+    def define_segments(self, startfrequency, stopfrequency, points, power, time, BW, set_time='dwell', verify=True):
+        '''
+        Define the whole segment table in one go, replacing any segments
+        already defined.
+
+        Each input is a scalar, the same for every segment, or an array with
+        one value per segment, so tables can step frequency, power or both.
+        The segments are sent a few dozen per command instead of one
+        define_segment call each, and read back together in as few
+        queries.
+
+        Input:
+            startfrequency [GHz]= frequency at which each segment starts
+            stopfrequency [GHz]= frequency at which each segment stops
+            points: number of points measured in each segment
+            power [dBm]: power of the VNA in each segment
+            time [s]: if set_time==dwell it is a delay for each partial measurement in the segment
+                      if set_time==sweeptime, we define the duration of the sweep in the segment
+            BW [Hz]: bandwidth in each segment
+            verify (bool): read the table back and compare it
+
+        Output:
+            table (array): (n_segments, 6) startfrequency, stopfrequency,
+                           points, power, time, BW, as read back if verify
+        '''
+        selections = {'dwell': 'DWEL', 'sweeptime': 'SWT'}
+        if set_time not in selections:
+            raise ValueError("set_time should be 'dwell' or 'sweeptime'")
+
+        table = np.column_stack(np.broadcast_arrays(*[np.atleast_1d(np.asarray(c, dtype=float)) for c in
+                                                      (startfrequency, stopfrequency, points, power, time, BW)]))
+
+        logging.debug(__name__ + ' : defining %s segments' % len(table))
+
+        commands = ['SEGM%d:DEF:SEL %s;:SEGM%d:DEF %.12gGHZ,%.12gGHZ,%d,%.12gDBM,%.12gS,0,%.12gHZ'
+                    % (i + 1, selections[set_time], i + 1, start, stop, n, pw, t, bw)
+                    for i, (start, stop, n, pw, t, bw) in enumerate(table)]
+
+        #Delete all the remaining segments from previous measurement
+        self.write('SEGM:DEL:ALL')
+        for i in range(0, len(commands), self.segments_per_command):
+            self.write(';:'.join(commands[i:i + self.segments_per_command]))
+
+        if not verify:
+            return table
+
+        readback = self.get_segments()
+        if readback.shape != table.shape:
+            print('Error: %d segments defined, wanted %d' % (len(readback), len(table)))
+            return readback
+
+        wrong = ~np.all(np.isclose(readback, table, rtol=1e-9, atol=1e-12), axis=1)
+        for i in np.flatnonzero(wrong):
+            print('error in setting segment %d' % (i + 1))
+            print(readback[i], table[i])
+
+        return readback
+
+    def get_segments(self):
+        '''
+        Read back the segment table with one compound SEGM:DEF? query per
+        few dozen segments.
+
+        Input:
+            None
+
+        Output:
+            table (array): (n_segments, 6) startfrequency [GHz],
+                           stopfrequency [GHz], points, power [dBm],
+                           time [s], BW [Hz]
+        '''
+        count = int(float(self.query('SEGM:COUNT?')))
+
+        rows = []
+        for first in range(1, count + 1, self.segments_per_command):
+            last = min(first + self.segments_per_command, count + 1)
+            resp = self.query(';:'.join('SEGM%d:DEF?' % i for i in range(first, last)))
+            rows += [row.split(',')[:7] for row in resp.strip().split(';')]
+
+        if not rows:
+            return np.zeros((0, 6))
+
+        rows = np.array(rows, dtype=float)
+        # The 6th field is unused
+        table = rows[:, [0, 1, 2, 3, 4, 6]]
+        table[:, :2] /= 1e9
+        return table
+
     def define_power_sweep(self, startpow, stoppow, steppow, cwfrequency, BW, time, set_time='dwell'):
         '''
         Make a sweep in power where startpow can be greater than stoppow
@@ -533,19 +1191,8 @@ class ZNB20(SocketInstrument):
         '''
         logging.debug(__name__ + ' : making a sweep in power from %s to %s with a step of %s' % (startpow, stoppow, steppow))
 
-        #Destroy all the remaining segments from previous measurement
-        self.write('SEGM:DEL:ALL')
-
-        if np.float(self.query('SEGM:COUNT?'))!=0:
-            print('Error: segments not deleted')
-
         pow_vec=np.arange(startpow, stoppow + steppow, steppow)
-        point=len(pow_vec)
-        for i in np.arange(point):
-            self.define_segment(i+1, cwfrequency, cwfrequency,1, pow_vec[i],time, BW, set_time )
-
-        if np.float(self.query('SEGM:COUNT?'))!=point:
-            print('Error: not the number of segment wanted')
+        self.define_segments(cwfrequency, cwfrequency, 1, pow_vec, time, BW, set_time)
 
     def define_power_sweep_vec(self, pow_vec, cwfrequency, BW, time, set_time='dwell'):
         '''
@@ -563,18 +1210,165 @@ class ZNB20(SocketInstrument):
         '''
         logging.debug(__name__ + ' : making a sweep in power' % ())
 
-        #Delete all the remaining segments from previous measurement
-        self.write('SEGM:DEL:ALL')
+        self.define_segments(cwfrequency, cwfrequency, 1, pow_vec, time, BW, set_time)
+
+
+#########################################################
+#
+#           Channels
+#
+#########################################################
+
+    def get_channels(self):
+        '''
+        Get the numbers of the channels that exist
+
+        Input:
+            None
+
+        Output:
+            channels (list): channel numbers
+        '''
+        logging.info(__name__ + ' : Get the channels')
+
+        catalog = self.query('CONF:CHAN:CAT?').strip().strip("'").split(',')
+        return [int(channel) for channel in catalog[0::2]]
+
+    def setup_channel(self, channel, startfrequency, stopfrequency, points, power, BW,
+                      traces = None, Sparams = None):
+        '''
+        Set up a channel with its own frequency range, power and
+        bandwidth, e.g. one channel per resonator, so that they can be
+        measured together with sweep(channel = 'all') and
+        get_channels_traces instead of reconfiguring a single channel for
+        each.
+
+            znb.setup_channel(1, 5.1e9, 5.2e9, 401, -30, 100, ('Trc1',), ('S21',))
+            znb.setup_channel(2, 6.3e9, 6.4e9, 401, -20, 100, ('Trc2',), ('S21',))
+            znb.sweep(channel = 'all')
+            traces = znb.get_channels_traces([1, 2])
+
+        Input:
+            channel (int): channel number
+            startfrequency, stopfrequency [Hz]: frequency range
+            points (int): points of the sweep
+            power [dBm]: source power
+            BW [Hz]: measurement bandwidth
+            traces (tuple): names of the traces to create in the channel,
+                            see create_traces. None to keep its traces.
+            Sparams (tuple): S parameter of each trace
+
+        Output:
+            None
+        '''
+        logging.info(__name__ + ' : set up channel %s' % channel)
+
+        if traces is not None:
+            self.create_traces(traces, Sparams, channel)
+
+        with self.configure():
+            self._set('sens%d:frequency:start' % channel, startfrequency)
+            self._set('sens%d:frequency:stop' % channel, stopfrequency)
+            self._set('sens%d:sweep:points' % channel, points)
+            self._set('source%d:power' % channel, power)
+            self._set('sens%d:band' % channel, BW)
+
+
+#########################################################
+#
+#           CW time domain
+#
+#########################################################
+
+    def setup_cw_timedomain(self, cwfrequency, BW, points = None):
+        '''
+        Set up a CW sweep for time traces at a single frequency: sweep
+        type CW, as many points per sweep as the instrument takes,
+        averaging off, trigger link on POIN and a binary transfer format.
+
+        Input:
+            cwfrequency [GHz]: frequency to measure at
+            BW [Hz]: measurement bandwidth, which sets the sampling rate
+            points (int): points per sweep, defaults to MAXCWPTS
+
+        Output:
+            interval (float): time between two points [s]
+        '''
+        logging.info(__name__ + ' : set up CW time traces at %s GHz' % cwfrequency)
+
+        if points is None:
+            points = self.MAXCWPTS
+
+        with self.configure():
+            self.set_sweeptype('CW')
+            self.set_cwfrequency(cwfrequency)
+            self.set_measBW(BW)
+            self.set_points(points)
+            self.set_averagestatus('off')
+            self.set_sweeps(1)
+        self.set_trigger_link('POIN')
+
+        if self.transfer_format == 'ascii':
+            self.set_transfer_format('real64')
+
+        return self.get_cw_interval()
+
+    def get_cw_interval(self):
+        '''
+        Time between two points of a CW sweep, from the sweep time, which
+        runs from the first point to the last.
+
+        Input:
+            None
+
+        Output:
+            interval (float): [s]
+        '''
+        points, sweeptime = self.query('sens:sweep:points?;:sens:sweep:time?').split(';')
+        return float(sweeptime)/max(int(points) - 1, 1)
+
+    def get_cw_timedomain(self, duration, channel = 1):
+        '''
+        Take CW sweeps, set up by setup_cw_timedomain, back to back until
+        duration of live time has been measured, and join them into one
+        time trace.
+
+        Each point is timestamped from the time its sweep was started and
+        the point interval, so the gaps between sweeps while the data is
+        fetched show up in the times instead of being spread over the
+        points.
+
+        Input:
+            duration (float): live time to measure [s]
+            channel (int): channel whose traces are fetched
+
+        Output:
+            times (array): unix time of each point
+            sparams (list): S parameter of each trace
+            data (complex array): (n_traces, n_sweeps*points)
+        '''
+        logging.info(__name__ + ' : take a %s s CW time trace' % duration)
+
+        points = int(self.query('sens:sweep:points?'))
+        interval = self.get_cw_interval()
+        n_sweeps = max(int(np.ceil(duration/(interval*points))), 1)
+        timeout = 2*self.get_sweep_time() + 10
+
+        offsets = np.arange(points)*interval
+        times = np.empty(n_sweeps*points)
+        data = None
 
-        if np.float(self.query('SEGM:COUNT?')) != 0:
-            print('Error: segments not deleted')
+        for i in range(n_sweeps):
+            start = time()
+            self.start_sweep(timeout).result()
+            _, sparams, sweep = self.get_all_traces(channel)
 
-        point = len(pow_vec)
-        for i in np.arange(point):
-            self.define_segment(i+1, cwfrequency, cwfrequency,1, pow_vec[i],time, BW, set_time )
+            if data is None:
+                data = np.empty((len(sparams), n_sweeps*points), dtype = complex)
+            np.add(start, offsets, out = times[i*points:(i + 1)*points])
+            data[:, i*points:(i + 1)*points] = sweep
 
-        if np.float(self.query('SEGM:COUNT?')) != point:
-            print('Error: not the number of segment wanted')
+        return times, sparams, data
 
 
 #########################################################
@@ -597,7 +1391,7 @@ class ZNB20(SocketInstrument):
         '''
 
         logging.info(__name__+' : Set the frequency of the instrument')
-        self.write('frequency:center '+str(centerfrequency))
+        self._set('frequency:center', centerfrequency)
 
 
     def get_centerfrequency(self):
@@ -628,7 +1422,7 @@ class ZNB20(SocketInstrument):
         '''
 
         logging.info(__name__+' : Set the frequency of the instrument')
-        self.write('frequency:span '+str(frequencyspan))
+        self._set('frequency:span', frequencyspan)
 
 
     def get_frequencyspan(self):
@@ -660,7 +1454,7 @@ class ZNB20(SocketInstrument):
         '''
 
         logging.info(__name__+' : Set the frequency of the instrument')
-        self.write('frequency:start '+str(startfrequency))
+        self._set('frequency:start', startfrequency)
 
 
     def get_startfrequency(self):
@@ -691,7 +1485,7 @@ class ZNB20(SocketInstrument):
         '''
 
         logging.info(__name__+' : Set the frequency of the instrument')
-        self.write('frequency:stop '+str(stopfrequency))
+        self._set('frequency:stop', stopfrequency)
 
 
     def get_stopfrequency(self):
@@ -723,7 +1517,7 @@ class ZNB20(SocketInstrument):
         '''
 
         logging.info(__name__+' : Set the CW frequency of the instrument')
-        self.write('SOUR:FREQ:CW '+str(cwfrequency)+ 'GHz')
+        self._set('SOUR:FREQ:CW', str(cwfrequency)+ 'GHz', expected = cwfrequency*1e9)
 
     def get_cwfrequency(self):
         '''
@@ -762,7 +1556,7 @@ class ZNB20(SocketInstrument):
         '''
 
         logging.info(__name__+' : Set the power of the instrument')
-        self.write('source:power '+str(power))
+        self._set('source:power', power)
 
 
     def get_power(self):
@@ -794,7 +1588,7 @@ class ZNB20(SocketInstrument):
         '''
 
         logging.info(__name__+' : Set the start power of the instrument')
-        self.write('SOUR:POW:STAR '+str(startpower))
+        self._set('SOUR:POW:STAR', startpower)
 
 
     def get_startpower(self):
@@ -823,7 +1617,7 @@ class ZNB20(SocketInstrument):
         '''
 
         logging.info(__name__+' : Set the stop power of the instrument')
-        self.write('SOUR:POW:STOP '+str(stoppower))
+        self._set('SOUR:POW:STOP', stoppower)
 
 
     def get_stoppower(self):
@@ -861,7 +1655,7 @@ class ZNB20(SocketInstrument):
         '''
 
         logging.info(__name__+' : Set the averages of the instrument')
-        self.write('average:count '+str(averages))
+        self._set('average:count', averages)
 
 
     def get_averages(self):
@@ -918,7 +1712,7 @@ class ZNB20(SocketInstrument):
             status = status.upper()
         else:
             raise ValueError('set_status(): can only set on or off')
-        self.write('average %s' % status.upper())
+        self._set('average', status.upper())
 
 
 #########################################################
@@ -942,7 +1736,7 @@ class ZNB20(SocketInstrument):
 
         logging.info(__name__+\
                      ' : Set the measurement bandwidth of the instrument')
-        self.write('sens:band '+str(measBW))
+        self._set('sens:band', measBW)
 
 
     def get_measBW(self):
@@ -982,7 +1776,7 @@ class ZNB20(SocketInstrument):
         '''
 
         logging.info(__name__+' : Set the number of points for the sweep')
-        self.write('sens:sweep:points '+str(points))
+        self._set('sens:sweep:points', points)
         self.nb_points = points
 
 
@@ -1020,8 +1814,8 @@ class ZNB20(SocketInstrument):
         '''
 
         logging.info(__name__+' : Set the power of the instrument')
-        self.write('initiate:cont Off ')
-        self.write('sens:sweep:count '+str(sweeps))
+        self._set('initiate:cont', 'OFF')
+        self._set('sens:sweep:count', sweeps)
 
 
     def get_sweeps(self):
@@ -1081,7 +1875,7 @@ class ZNB20(SocketInstrument):
             status = status.upper()
         else:
             raise ValueError('set_status(): can only set on or off')
-        self.write('output %s' % status)
+        self._set('output', status)
 
 
 #########################################################
@@ -1127,11 +1921,11 @@ class ZNB20(SocketInstrument):
         logging.debug(__name__ + ' : set the drving mode to %s' % mode)
 
         if mode.lower() == 'auto':
-            self.write('COUP AUTO')
+            self._set('COUP', 'AUTO')
         elif mode.lower() == 'alternated':
-            self.write('COUP NONE')
+            self._set('COUP', 'NONE')
         elif mode.lower() == 'chopped':
-            self.write('COUP ALL')
+            self._set('COUP', 'ALL')
         else:
             raise ValueError("The mode must be 'auto', 'alternated' or 'chopped'")
 
@@ -1159,7 +1953,7 @@ class ZNB20(SocketInstrument):
         '''
 
         logging.info(__name__+' : Set the time delay for port 1')
-        self.write('sens:corr:edel1:time '+str(time))
+        self._set('sens:corr:edel1:time', time)
 
 
     def get_delay_time_p1(self):
@@ -1191,7 +1985,7 @@ class ZNB20(SocketInstrument):
         '''
 
         logging.info(__name__+' : Set the time delay for port 2')
-        self.write('sens:corr:edel2:time '+str(time))
+        self._set('sens:corr:edel2:time', time)
 
 
     def get_delay_time_p2(self):
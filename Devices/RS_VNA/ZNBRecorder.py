@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# ZNBRecorder.py streams repeated ZNB20 sweeps into an HDF5 file as they
+# are measured.
+
+import logging
+import threading
+import numpy as np
+import h5py
+from time import time
+
+
+class SweepRecorder:
+    '''
+    Trigger repeated sweeps on a ZNB20 and write each one to disk as soon
+    as it's fetched, so long scans aren't limited by memory and can be
+    looked at while they're running.
+
+    Every sweep of every trace in the channel is appended to a chunked,
+    resizable HDF5 dataset, one chunk per sweep:
+
+        /data       (n_sweeps, n_traces, n_points) complex
+        /time       (n_sweeps,) end of each sweep, unix time
+        /stimulus   (n_points,) frequencies [Hz] or powers [dBm]
+
+    with the S parameter of each trace in the 'sparams' attribute of /data.
+    The file is written in SWMR mode and flushed after every sweep, so
+    read_recording (or h5py with swmr=True) can read it meanwhile.
+
+    Sweeps are pipelined: the next sweep is started as soon as the last
+    one has been fetched, and runs while that one is written.
+
+        recorder = SweepRecorder(znb, 'overnight.h5')
+        recorder.record(n_sweeps = 1000)
+
+    Input:
+        znb (ZNB20): the instrument, set up for the measurement
+        path (string): HDF5 file to write, overwritten if it exists
+        channel (int): channel whose traces are recorded
+        compression (string): h5py compression for /data, e.g. 'gzip'
+        attrs (dict): attributes to store with the file, e.g. settings
+    '''
+
+    def __init__(self, znb, path, channel = 1, compression = None, attrs = None):
+        self.znb = znb
+        self.path = path
+        self.channel = channel
+        self.compression = compression
+        self.attrs = attrs or {}
+        self.count = 0
+
+        self._stop = threading.Event()
+
+    def stop(self):
+        '''
+        Stop recording after the current sweep, e.g. from another thread.
+        '''
+        self._stop.set()
+
+    def _create(self, f, stimulus, sparams, data):
+        '''
+        Create the datasets, sized from the first sweep.
+        '''
+        f.create_dataset('stimulus', data = stimulus)
+        f.create_dataset('time', shape = (0,), maxshape = (None,), dtype = 'f8', chunks = (1024,))
+        dset = f.create_dataset('data', shape = (0,) + data.shape, maxshape = (None,) + data.shape,
+                                dtype = data.dtype, chunks = (1,) + data.shape,
+                                compression = self.compression)
+        dset.attrs['sparams'] = sparams
+        for key, value in self.attrs.items():
+            f.attrs[key] = value
+
+        # Attributes can't be changed from here on
+        f.swmr_mode = True
+
+    def _append(self, f, data, t):
+        '''
+        Write one sweep and make it visible to readers.
+        '''
+        if data.shape != f['data'].shape[1:]:
+            raise ValueError('Sweep %d has %d traces of %d points, the recording has %d of %d. '
+                             'setup mustn\'t change the number of points or traces'
+                             % ((f['data'].shape[0],) + data.shape + f['data'].shape[1:]))
+        i = f['data'].shape[0]
+        f['data'].resize(i + 1, axis = 0)
+        f['time'].resize(i + 1, axis = 0)
+        f['data'][i] = data
+        f['time'][i] = t
+        f.flush()
+
+    def record(self, n_sweeps = None, setup = None, callback = None):
+        '''
+        Record sweeps until n_sweeps have been taken or stop() is called.
+
+        Input:
+            n_sweeps (int): number of sweeps, None to go on until stopped
+            setup (function): called with the sweep number before each
+                              sweep is started, to change settings between
+                              sweeps. The datasets are sized from the first
+                              sweep, so it mustn't change the number of
+                              points or traces, and /stimulus is only
+                              written once.
+            callback (function): called with the sweep number, the time
+                                 and the data of each sweep once it's
+                                 written
+
+        Output:
+            count (int): number of sweeps recorded
+        '''
+        logging.info(__name__ + ' : recording sweeps to %s' % self.path)
+
+        self._stop.clear()
+        self.count = 0
+
+        # Work out the sweep timeout once, unless setup can change it
+        timeout = None
+        if setup is None:
+            timeout = 2*self.znb.get_sweep_time() + 10
+
+        with h5py.File(self.path, 'w', libver = 'latest') as f:
+            if setup is not None:
+                setup(0)
+            sweep = self.znb.start_sweep(timeout)
+
+            while True:
+                sweep.result()
+                t = time()
+                stimulus, sparams, data = self.znb.get_all_traces(self.channel)
+
+                done = self._stop.is_set() or (n_sweeps is not None and self.count + 1 >= n_sweeps)
+                if not done:
+                    if setup is not None:
+                        setup(self.count + 1)
+                    sweep = self.znb.start_sweep(timeout)
+
+                if self.count == 0:
+                    self._create(f, stimulus, sparams, data)
+                self._append(f, data, t)
+
+                if callback is not None:
+                    callback(self.count, t, data)
+                self.count += 1
+
+                if done:
+                    break
+
+        return self.count
+
+
+def read_recording(path, sweeps = slice(None)):
+    '''
+    Read a recording made by SweepRecorder, also while it's still being
+    written.
+
+    Input:
+        path (string): HDF5 file
+        sweeps (slice or array): which sweeps to read
+
+    Output:
+        stimulus (array): frequencies [Hz] or powers [dBm]
+        sparams (list): S parameter of each trace
+        times (array): end time of each sweep read
+        data (complex array): (n_sweeps, n_traces, n_points)
+    '''
+    with h5py.File(path, 'r', libver = 'latest', swmr = True) as f:
+        stimulus = f['stimulus'][()]
+        sparams = [sparam.decode() if isinstance(sparam, bytes) else str(sparam)
+                   for sparam in f['data'].attrs['sparams']]
+        # The writer may have added sweeps since the file was opened
+        f['time'].refresh()
+        f['data'].refresh()
+        n = min(len(f['time']), len(f['data']))
+        index = np.arange(n)[sweeps]
+        return stimulus, sparams, f['time'][index], f['data'][index]
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# LoopbackServer.py is an SCPI server on localhost, to try SCPITransport and
+# the drivers built on it without an instrument.
+
+import time
+import socket
+import threading
+import numpy as np
+
+
+def block(data):
+    '''
+    Make an IEEE 488.2 definite length block, as instruments send binary data.
+
+    Input:
+        data (bytes or array): block contents, arrays are sent as their
+                               raw bytes
+
+    Output:
+        block (bytes): #<digits><length><data>
+    '''
+    if isinstance(data, np.ndarray):
+        data = np.ascontiguousarray(data).tobytes()
+    size = str(len(data)).encode()
+    return b'#' + str(len(size)).encode() + size + bytes(data)
+
+
+class LoopbackServer:
+    '''
+    SCPI server on a local TCP socket, answering queries from a table.
+
+    Each line received is split into commands at ';'. A command is looked
+    up in handlers first as a whole, e.g. 'CALC:DATA? SDAT', then by its
+    header alone, e.g. 'SOUR:POW', in upper case and without the leading
+    ':'. A handler is either the reply itself (string or bytes) or a
+    function called with the arguments of the command, as a string, that
+    returns the reply, or None for commands that have none. Replies to the
+    queries of a line are joined with ';' and sent as one line, like an
+    instrument does. Commands without a handler are kept in self.unknown.
+
+        handlers = {'*IDN?': 'Loopback,0,0,0',
+                    'CALC:DATA? SDAT': block(np.zeros(201, '<c16'))}
+        with LoopbackServer(handlers) as server:
+            scpi = SCPITransport(server.address)
+
+    Input:
+        handlers (dict): command or header -> reply or function
+        latency (float): delay before each reply [s]
+        host (string): interface to listen on
+        port (int): port to listen on, 0 picks a free one
+    '''
+
+    def __init__(self, handlers = None, latency = 0., host = '127.0.0.1', port = 0):
+        self.handlers = dict(handlers or {})
+        self.latency = latency
+
+        self.lines = 0
+        self.commands = 0
+        self.unknown = []
+        self._connections = []
+
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self.host, self.port = self._server.getsockname()
+
+    @property
+    def address(self):
+        return '%s:%d' % (self.host, self.port)
+
+    def start(self):
+        '''
+        Start accepting connections in a background thread.
+        '''
+        self._server.listen()
+        threading.Thread(target = self._accept, daemon = True).start()
+        return self
+
+    def stop(self):
+        '''
+        Stop accepting connections and close the open ones.
+        '''
+        self._server.close()
+        self.disconnect()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def disconnect(self):
+        '''
+        Close the open connections, like an instrument that's been power
+        cycled, to test reconnecting.
+        '''
+        for conn in self._connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conn.close()
+        self._connections = []
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._connections.append(conn)
+            threading.Thread(target = self._serve, args = (conn,), daemon = True).start()
+
+    def _serve(self, conn):
+        buf = b''
+        with conn:
+            while True:
+                try:
+                    data = conn.recv(1 << 16)
+                except OSError:
+                    return
+                if not data:
+                    return
+                buf += data
+                while b'\n' in buf:
+                    line, buf = buf.split(b'\n', 1)
+                    reply = self.handle_line(line.decode())
+                    if reply is not None:
+                        time.sleep(self.latency)
+                        try:
+                            conn.sendall(reply + b'\n')
+                        except OSError:
+                            return
+
+    def handle_line(self, line):
+        '''
+        Run the commands of one line.
+
+        Input:
+            line (string): without the terminator
+
+        Output:
+            reply (bytes): replies joined with ';', None if there are none
+        '''
+        self.lines += 1
+        replies = []
+        for cmd in line.split(';'):
+            cmd = cmd.strip().lstrip(':')
+            if not cmd:
+                continue
+            self.commands += 1
+            reply = self.handle_command(cmd)
+            if reply is not None:
+                replies.append(reply.encode() if isinstance(reply, str) else bytes(reply))
+        return b';'.join(replies) if replies else None
+
+    def handle_command(self, cmd):
+        '''
+        Look up one command in the handlers.
+
+        Input:
+            cmd (string): command with its arguments
+
+        Output:
+            reply (string or bytes): None if there's none
+        '''
+        header, _, args = cmd.partition(' ')
+        for key in (' '.join(cmd.upper().split()), header.upper()):
+            if key in self.handlers:
+                handler = self.handlers[key]
+                return handler(args.strip()) if callable(handler) else handler
+        self.unknown.append(cmd)
+        return None
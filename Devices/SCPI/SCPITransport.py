@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+# SCPITransport.py is a raw socket SCPI connection shared by the instrument
+# drivers (ZNB20, E36300, ...).
+
+import socket
+import select
+import logging
+import threading
+from time import sleep, perf_counter
+
+
+class SCPITransport:
+    '''
+    Persistent SCPI connection over a raw TCP socket (port 5025 on most
+    instruments).
+
+    The connection is opened on first use and kept open. If it drops, it's
+    reopened and the query sent again, up to reconnect times. A command
+    without a reply is only sent again if the connection was found closed
+    before sending it: one that got through before the connection dropped
+    (INIT, *CLS, ...) would otherwise run twice. Pass retry_writes = True to
+    resend those too. A read that times out closes the connection, so a
+    late reply isn't taken for the reply to the next query. Replies are
+    read up to the terminator, so there's no need to sleep between writing
+    a query and reading its reply; query_sleep is there for instruments
+    that need it, and can also be given per query.
+
+    Bytes sent and received, number of commands and time spent are counted
+    per command header in self.stats.
+
+    A transport that isn't enabled never connects: commands are dropped
+    and queries return None, to run scripts without the instrument.
+
+    Input:
+        address (string): 'ip' or 'ip:port', None if there's no instrument
+        port (int): port, if not in address
+        timeout (float): socket timeout [s]
+        query_sleep (float): pause between writing a query and reading its
+                             reply [s]
+        termination (string): line terminator
+        reconnect (int): number of times to reconnect and retry a command
+                         when the connection drops
+        retry_writes (bool): also resend commands without a reply that may
+                             have reached the instrument already
+        enabled (bool): talk to the instrument at all
+    '''
+
+    def __init__(self, address, port = 5025, timeout = 10, query_sleep = 0, termination = '\n', reconnect = 2,
+                 retry_writes = False, enabled = True):
+        if address is not None and ':' in address:
+            address, port = address.split(':')
+        self.address = None if address is None else (address, int(port))
+        self.enabled = enabled
+        self.timeout = timeout
+        self.query_sleep = query_sleep
+        self.termination = termination
+        self.reconnect = reconnect
+        self.retry_writes = retry_writes
+
+        self.sock = None
+        self.lock = threading.RLock()
+        self.stats = {}
+
+        self._buffer = bytearray()
+        self._header = None
+        self._sent = False
+
+    def connect(self):
+        '''
+        Open the connection, closing it first if it's open.
+        '''
+        self.close()
+        if self.address is None:
+            raise IOError('No address to connect to')
+        logging.info(__name__ + ' : connecting to %s:%s' % self.address)
+        self.sock = socket.create_connection(self.address, timeout = self.timeout)
+        # Commands are short and sent back to back, don't let Nagle hold them
+        # back waiting for ACKs
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buffer.clear()
+
+    def close(self):
+        '''
+        Close the connection, it's reopened by the next command.
+        '''
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _count(self, key, value):
+        stats = self.stats.setdefault(self._header, {'count': 0, 'sent': 0, 'received': 0, 'time': 0.})
+        stats[key] += value
+
+    def reset_stats(self):
+        self.stats = {}
+
+    def _closed(self):
+        '''
+        Whether the instrument has closed the connection. A write to a
+        closed connection can still succeed once, and be lost, so this is
+        checked before each command.
+        '''
+        readable, _, _ = select.select([self.sock], [], [], 0)
+        if not readable:
+            return False
+        try:
+            return not self.sock.recv(1, socket.MSG_PEEK)
+        except ConnectionError:
+            return True
+
+    def _retry(self, f, resend = True):
+        '''
+        Run f, reconnecting and running it again if the connection drops.
+        With resend False, f is only run again if it hadn't sent anything
+        yet. Returns None without running f if the transport isn't
+        enabled.
+        '''
+        if not self.enabled:
+            return None
+        with self.lock:
+            for attempt in range(self.reconnect + 1):
+                self._sent = False
+                try:
+                    if self.sock is None or self._closed():
+                        self.connect()
+                    return f()
+                except (ConnectionError, socket.gaierror) as e:
+                    logging.warning(__name__ + ' : connection to %s:%s lost: %s' % (self.address + (e,)))
+                    self.close()
+                    if attempt == self.reconnect or (self._sent and not resend):
+                        raise
+
+    def _timed_out(self):
+        '''
+        Drop the connection after a read timed out. The rest of the reply
+        may still arrive, and would be read as the reply to the next query.
+        '''
+        logging.warning(__name__ + ' : no reply from %s:%s in time, reconnecting' % self.address)
+        self.close()
+        self._buffer.clear()
+
+    def _send(self, cmd):
+        self._header = cmd.split(' ')[0].upper()
+        data = (cmd + self.termination).encode()
+        self._sent = True
+        self.sock.sendall(data)
+        self._count('count', 1)
+        self._count('sent', len(data))
+
+    def write(self, cmd):
+        '''
+        Send a command.
+
+        Input:
+            cmd (string): SCPI command
+
+        Output:
+            None
+        '''
+        def send():
+            start = perf_counter()
+            self._send(cmd)
+            self._count('time', perf_counter() - start)
+
+        self._retry(send, self.retry_writes)
+
+    def _query(self, cmd, read, query_sleep):
+        def exchange():
+            start = perf_counter()
+            self._send(cmd)
+            sleep(self.query_sleep if query_sleep is None else query_sleep)
+            reply = read()
+            self._count('time', perf_counter() - start)
+            return reply
+
+        return self._retry(exchange)
+
+    def query(self, cmd, query_sleep = None):
+        '''
+        Send a query and read its reply up to the terminator.
+
+        Input:
+            cmd (string): SCPI query
+            query_sleep (float): pause before reading [s], defaults to
+                                 self.query_sleep
+
+        Output:
+            reply (string): without the terminator
+        '''
+        return self._query(cmd, self.read_line, query_sleep)
+
+    def query_block(self, cmd, query_sleep = None, into = None):
+        '''
+        Send a query whose reply is a binary block, see read_block.
+
+        Input:
+            cmd (string): SCPI query
+            query_sleep (float): pause before reading [s]
+            into (bytearray): buffer to read the block into
+
+        Output:
+            data (bytearray or memoryview)
+        '''
+        return self._query(cmd, lambda: self.read_block(into), query_sleep)
+
+    def _recv(self):
+        try:
+            chunk = self.sock.recv(1 << 16)
+        except socket.timeout:
+            self._timed_out()
+            raise
+        if not chunk:
+            raise ConnectionError('Connection closed by the instrument')
+        self._buffer += chunk
+        self._count('received', len(chunk))
+
+    def read_line(self, timeout = None):
+        '''
+        Read up to the terminator.
+
+        Input:
+            timeout (float): socket timeout for this read [s], defaults to
+                             self.timeout
+
+        Output:
+            line (string): without the terminator
+        '''
+        terminator = self.termination.encode()
+        if timeout is not None:
+            self.sock.settimeout(timeout)
+        try:
+            start = 0
+            while True:
+                end = self._buffer.find(terminator, start)
+                if end >= 0:
+                    line = self._buffer[:end].decode()
+                    del self._buffer[:end + len(terminator)]
+                    return line
+                start = max(0, len(self._buffer) - len(terminator) + 1)
+                self._recv()
+        finally:
+            if timeout is not None and self.sock is not None:
+                self.sock.settimeout(self.timeout)
+
+    def read_text(self):
+        '''
+        Read one reply of a compound query, up to the ';' separating it from
+        the next one or the terminator.
+
+        Input:
+            None
+
+        Output:
+            text (string)
+        '''
+        separators = (ord(';'), ord(self.termination[0]))
+        start = 0
+        while True:
+            ends = [i for i in (self._buffer.find(sep, start) for sep in separators) if i >= 0]
+            if ends:
+                end = min(ends)
+                text = self._buffer[:end].decode()
+                del self._buffer[:end + 1]
+                return text
+            start = len(self._buffer)
+            self._recv()
+
+    def read_bytes(self, n, into = None):
+        '''
+        Read exactly n bytes, into a buffer that np.frombuffer can use
+        without copying.
+
+        Input:
+            n (int): number of bytes
+            into (bytearray): buffer of at least n bytes to read into,
+                              reused instead of allocating a new one
+
+        Output:
+            data (bytearray or memoryview): the n bytes, a view of into if
+                                            given
+        '''
+        if into is None:
+            data = bytearray(n)
+            view = memoryview(data)
+        else:
+            if len(into) < n:
+                raise ValueError('Buffer of %d bytes too small for %d bytes' % (len(into), n))
+            data = view = memoryview(into)[:n]
+
+        received = min(n, len(self._buffer))
+        view[:received] = self._buffer[:received]
+        del self._buffer[:received]
+
+        while received < n:
+            try:
+                nbytes = self.sock.recv_into(view[received:], n - received)
+            except socket.timeout:
+                self._timed_out()
+                raise
+            if nbytes == 0:
+                raise ConnectionError('Connection closed by the instrument')
+            received += nbytes
+            self._count('received', nbytes)
+        return data
+
+    def read_block(self, into = None):
+        '''
+        Read an IEEE 488.2 definite length block, #<digits><length><data>,
+        and the terminator or ';' after it.
+
+        Input:
+            into (bytearray): buffer to read the contents into, see
+                              read_bytes. A new one is allocated if it's
+                              too small for the block.
+
+        Output:
+            data (bytearray or memoryview): the block contents
+        '''
+        header = self.read_bytes(2)
+        if header[:1] != b'#' or header[1:2] in b'0':
+            raise IOError('Expected a definite length block, got %r' % bytes(header))
+
+        length = int(self.read_bytes(int(header[1:2])))
+        if into is not None and len(into) < length:
+            into = None
+        data = self.read_bytes(length, into)
+        self.read_bytes(1)
+        return data
+
+    def print_stats(self):
+        '''
+        Print commands, bytes and time spent per command header.
+        '''
+        print('%-24s\t%8s\t%10s\t%10s\t%12s' % ('command', 'count', 'sent', 'received', 'time [ms]'))
+        for header, stats in sorted(self.stats.items(), key = lambda item: -item[1]['time']):
+            print('%-24s\t%8d\t%10d\t%10d\t%12.2f' % (header[:24], stats['count'], stats['sent'],
+                                                      stats['received'], stats['time'] * 1e3))
@@ -0,0 +1,30 @@
+"""Convert logged LS372 resistances to temperatures, offline.
+
+Adds a T<n> column next to each R<n> column of a log written by
+Examples/Olaf/Logger.py, using the calibration curve files (.340) given for
+each channel. Nothing is asked of the instrument.
+
+usage: python ConvertLog.py <log.csv> <channel>:<curve.340> [<channel>:<curve.340> ...]
+  e.g. python ConvertLog.py 20240101_log.csv 1:RX102B.340 6:RuOx.340
+"""
+
+import sys
+import pandas as pd
+
+sys.path.append("../../Devices/Lakeshore")
+
+from Lakeshore372 import format_key, read_curve_file, resistance_to_temperature
+
+if __name__ == "__main__":
+    csv_path = sys.argv[1]
+    log = pd.read_csv(csv_path)
+
+    for arg in sys.argv[2:]:
+        channel, curve_file = arg.split(':', 1)
+        header, breakpoints = read_curve_file(curve_file)
+        log[f'T{channel}'] = resistance_to_temperature(log[f'R{channel}'].to_numpy(), breakpoints,
+                                                       format_key[header[2]])
+
+    out_path = csv_path.replace('.csv', '_temperatures.csv')
+    log.to_csv(out_path, index=False)
+    print(f'Temperatures written to {out_path}')
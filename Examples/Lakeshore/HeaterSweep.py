@@ -0,0 +1,58 @@
+"""Step the MC heater up and back down, moving on as soon as the stage settles.
+
+Same sweep as Examples/Bluefors/tcsweep.py, but instead of a fixed wait per
+step the thermometer channel is watched and the next step starts once its
+temperature has stopped drifting. Every reading is logged to a csv file.
+
+usage: python HeaterSweep.py <ip> <thermometer channel> [max percent] [step percent]
+"""
+
+import sys
+import csv
+import datetime
+import numpy as np
+
+sys.path.append("../../Devices/Lakeshore")
+
+from Lakeshore372 import LS372, HeaterScheduler
+
+if __name__ == "__main__":
+    ip = sys.argv[1]
+    channel = int(sys.argv[2])
+    max_pct = float(sys.argv[3]) if len(sys.argv) > 3 else 100.0
+    step_pct = float(sys.argv[4]) if len(sys.argv) > 4 else 1.0
+
+    ls = LS372(ip)
+    heater = ls.sample_heater
+    heater.set_heater_display('current')
+    heater.set_heater_range(1e-3)
+
+    up = np.arange(step_pct, max_pct + step_pct / 2, step_pct)
+    steps = np.concatenate([up, up[-2::-1], [0]])
+
+    # Settled: drifting less than 1 uK/s over the last two minutes
+    sweep = HeaterScheduler(heater, ls.channels[channel], steps, mode='output',
+                            slope=1e-6, window=120, timeout=1800, interval=5)
+
+    date = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    csv_path = f'{date}_heater_sweep.csv'
+
+    try:
+        with open(csv_path, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['Time', 'Heater', 'Settled', f'T{channel}'])
+            for step in sweep:
+                for reading in step.readings:
+                    writer.writerow([reading.time, step.value, step.settled, reading.value])
+                csvfile.flush()
+                if not step.readings:
+                    # Stopped before the first reading of the step
+                    print(f'{step.value:6.2f} %: no readings')
+                    continue
+                print(f'{step.value:6.2f} %: {step.readings[-1].value * 1e3:.3f} mK after '
+                      f'{step.end - step.start:.0f} s, settled: {step.settled}')
+    finally:
+        # if something goes wrong, turn off heater
+        heater.set_heater_output(0)
+
+    print(f'Readings written to {csv_path}')
@@ -0,0 +1,63 @@
+"""Compare LS372 query throughput with adaptive pacing vs the old fixed sleeps.
+
+Runs the simulated 372 from Fake372.py on localhost, then times a batch of
+plain queries and reading queries through both versions of LS372.msg, and
+readings packed four to a compound line. The adaptive pacer charges each
+reading of a compound line against the 10 readings/s budget, so packing
+saves round trips but doesn't raise the reading rate.
+
+usage: python PacingBenchmark.py [n_queries]
+"""
+
+import sys
+import time
+
+sys.path.append("../../Devices/Lakeshore")
+
+from Lakeshore372 import LS372
+from Fake372 import Fake372
+
+
+class FixedSleepLS372(LS372):
+    """LS372 with the original fixed 61 ms / 100 ms sleeps in msg."""
+
+    def msg(self, message):
+        msg_str = f'{message}\r\n'.encode()
+        self.com.send(msg_str)
+        if '?' in message:
+            time.sleep(0.061)
+            resp = str(self.com.recv(4096), 'utf-8').strip()
+        else:
+            resp = ''
+
+        if 'RDG' in message:
+            time.sleep(0.1)
+        else:
+            time.sleep(0.061)
+        return resp
+
+
+def queries_per_second(ls, message, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        ls.msg(message)
+    return n / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    fake = Fake372(latency=0.002).start()
+
+    packed = ';'.join(['RDGR? 1'] * 4)
+
+    print("%-12s\t%12s\t%12s\t%16s" % ("", "*IDN? [q/s]", "RDGR? [q/s]", "packed [rdg/s]"))
+    for cls in [FixedSleepLS372, LS372]:
+        ls = cls('127.0.0.1', port=fake.port)
+        idn = queries_per_second(ls, '*IDN?', n)
+        rdg = queries_per_second(ls, 'RDGR? 1', n)
+        rdg_packed = 4 * queries_per_second(ls, packed, n // 4)
+        print("%-12s\t%12.2f\t%12.2f\t%16.2f" % ("fixed" if cls is FixedSleepLS372 else "adaptive", idn, rdg,
+                                                  rdg_packed))
+        ls.com.close()
+    print(f"quiet-time violations seen by the fake 372: {fake.quiet_violations}")
+    fake.stop()
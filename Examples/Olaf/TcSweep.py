@@ -34,12 +34,10 @@ heater_devices = ['DRI_MIX_CL.DRI_MIX_H', 'DRI_STL_H']
 
 def getChannelSettings(minChan, maxChan):
     
-    lakeshore = []
+    readings = ls.read_many(range(minChan, maxChan+1), ('resistance', 'power'))
     
-    for i in range(minChan, maxChan+1):
-        chan = ls.channels[i]
-        lakeshore.append(chan.get_resistance_reading())
-        lakeshore.append(chan.get_excitation_power())    
+    # R1, P1, R2, P2, ...
+    lakeshore = np.column_stack([readings['resistance'], readings['power']]).flatten().tolist()
     
     return lakeshore
 
@@ -0,0 +1,105 @@
+"""Compare ZNB20 trace transfer in ASCII and binary (REAL,32 / REAL,64) formats.
+
+Runs a LoopbackServer on localhost that answers CALC:DATA? SDAT with
+n_points of S-parameter data in whatever format FORM:DATA asked for, then
+times ZNB20._get_data, and the decoding on its own, for each transfer format.
+Also compares fetching two traces one at a time with ZNB20.get_all_traces.
+
+Replies are delayed 2 ms, roughly a LAN round trip to the instrument.
+
+usage: python ZNBTransferBenchmark.py [n_points] [n_repeats]
+"""
+
+import sys
+import time
+import numpy as np
+
+sys.path.append("../../Devices/RS_VNA")
+sys.path.append("../../Devices/SCPI")
+
+from ZNB import ZNB20
+from LoopbackServer import LoopbackServer, block
+
+
+def encode(values, form):
+    """Reply to a data query in the FORM:DATA format, without terminator."""
+    values = np.ascontiguousarray(values).view(np.float64).ravel()
+    if form.startswith('ASC'):
+        return ','.join('%.12e' % v for v in values).encode()
+    return block(values.astype('<f4' if form == 'REAL,32' else '<f8'))
+
+
+def make_payloads(traces, stimulus):
+    """Replies to the data queries for each FORM:DATA setting."""
+    payloads = {}
+    for form in ['ASC,0', 'REAL,32', 'REAL,64']:
+        payloads[form] = {'CALC:DATA? SDAT': encode(traces[0], form),
+                          'CALC1:DATA:CALL? SDAT': encode(traces, form),
+                          'CALC1:DATA:STIM?': encode(stimulus, form)}
+    return payloads
+
+
+def start_scpi_stub(n_points, latency=0.002):
+    """Start the server in a background thread, return it and the payloads."""
+    rng = np.random.default_rng(0)
+    traces = rng.normal(size=(2, n_points)) + 1j * rng.normal(size=(2, n_points))
+    stimulus = np.linspace(4e9, 8e9, n_points)
+    payloads = make_payloads(traces, stimulus)
+    form = ['ASC,0']
+
+    def set_form(args):
+        form[0] = 'ASC,0' if args.upper().startswith('ASC') else args.upper().replace(' ', '')
+
+    handlers = {'*IDN?': 'Rohde-Schwarz,ZNB20-2Port,0,0',
+                'FORM:DATA': set_form,
+                'FORM:DATA?': lambda args: form[0],
+                'CALC1:DATA:CALL:CAT?': "'S21,S11'"}
+    for cmd in payloads['ASC,0']:
+        handlers[cmd] = lambda args, cmd=cmd: payloads[form[0]][cmd]
+
+    return LoopbackServer(handlers, latency=latency).start(), payloads
+
+
+def seconds_per_call(f, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        f()
+    return (time.perf_counter() - start) / n
+
+
+if __name__ == "__main__":
+    n_points = int(sys.argv[1]) if len(sys.argv) > 1 else 1601
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    server, payloads = start_scpi_stub(n_points)
+
+    znb = ZNB20(address=server.address)
+    znb.set_points(n_points)
+
+    print("%d points, %d repeats" % (n_points, n))
+    print("%-8s\t%10s\t%14s\t%12s" % ("", "bytes", "_get_data [ms]", "decode [ms]"))
+    for transfer_format, form in [('real64', 'REAL,64'), ('real32', 'REAL,32'), ('ascii', 'ASC,0')]:
+        znb.set_transfer_format(transfer_format)
+        total = seconds_per_call(lambda: znb._get_data('Trc1', 'real-imag'), n)
+
+        payload = payloads[form]['CALC:DATA? SDAT']
+        if transfer_format == 'ascii':
+            decode = seconds_per_call(lambda: np.fromstring(payload.decode(), sep=','), n)
+        else:
+            digits = int(payload[1:2])
+            block = bytearray(payload[2 + digits:])
+            dtype = ZNB20.transfer_dtypes[transfer_format]
+            decode = seconds_per_call(lambda: np.frombuffer(block, dtype=dtype), n)
+
+        print("%-8s\t%10d\t%14.2f\t%12.4f" % (transfer_format, len(payload), total * 1e3, decode * 1e3))
+
+    print()
+    print("2 traces + stimulus")
+    print("%-8s\t%18s\t%18s" % ("", "per trace [ms]", "get_all_traces [ms]"))
+    for transfer_format in ['real64', 'real32']:
+        znb.set_transfer_format(transfer_format)
+        per_trace = seconds_per_call(lambda: [znb._get_data(t, 'real-imag') for t in ('Trc1', 'Trc2')], n)
+        bulk = seconds_per_call(lambda: znb.get_all_traces(), n)
+        print("%-8s\t%18.2f\t%18.2f" % (transfer_format, per_trace * 1e3, bulk * 1e3))
+
+    print()
+    znb.print_stats()